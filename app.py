@@ -5,33 +5,169 @@
 使用Flask框架创建现代化的登录界面
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, make_response, g, current_app
 from student_db_manager import StudentLDAPManager
+from ldap_async import AsyncStudentLDAPManager
+from student_export import EXPORT_FORMATS
+from student_paging import decode_cursor, empty_page
+from student_record import resolve_columns
+from user_identity import load_identity
 from ldap3 import MODIFY_REPLACE
-from captcha_utils import generate_captcha, verify_captcha
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT
+from captcha_utils import generate_captcha, verify_captcha, get_captcha_image, captcha_pool
+from import_jobs import ImportJobManager
+from student_sync import DirectorySync
+from credentials import hash_password
+from metrics import registry as metrics
+from log_utils import get_logger, fields, setup_logging
+from static_assets import AssetManifest
+import hashlib
+import hmac
+import json
 import os
+import tempfile
+import time
 from functools import wraps
+from werkzeug.http import is_resource_modified
+from operator import attrgetter
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json
+    orjson = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # 在生产环境中应该使用更安全的密钥
 
-# 创建LDAP管理器实例
+# 静态资源按内容哈希引用（构建见 static_assets.py），带指纹的文件可长期缓存
+assets = AssetManifest(app.static_folder)
+app.get_send_file_max_age = assets.send_file_max_age
+
+@app.template_global()
+def asset_url(filename):
+    """模板中引用自定义CSS/JS的URL，内容变化时URL才变化"""
+    target, version = assets.resolve(filename)
+    url = url_for('static', filename=target)
+    return f'{url}?v={version}' if version else url
+
+# 日志经队列由后台线程写出，级别和格式见 LOG_LEVEL / LOG_FORMAT
+setup_logging()
+logger = get_logger('app')
+
+# 创建LDAP管理器实例（内部维护线程安全的连接池）
 ldap_manager = StudentLDAPManager()
 
+# 异步视图使用的LDAP访问：与 ldap_manager 共用连接池、身份缓存和学生索引，阻塞调用在执行线程中完成
+async_ldap = AsyncStudentLDAPManager(ldap_manager)
+
+# 后台批量导入任务
+import_jobs = ImportJobManager(ldap_manager)
+
+# 后台增量同步：吸收在本应用之外对目录做的修改
+directory_sync = DirectorySync(ldap_manager, interval=ldap_manager.LDAP_SYNC_INTERVAL)
+IMPORT_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+@app.before_request
+def start_directory_sync():
+    """第一个请求到来时启动后台增量同步线程"""
+    directory_sync.start()
+
+@app.before_request
+def start_request_metrics():
+    """记录请求开始时间，本线程上的LDAP操作归到当前路由"""
+    g.request_started = time.perf_counter()
+    metrics.endpoint = request.endpoint or 'unknown'
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def release_ldap_connection(exc):
+    """请求结束时归还未显式释放的LDAP连接"""
+    ldap_manager.disconnect()
+
+@app.teardown_request
+def record_request_metrics(exc):
+    """请求结束时记录路由耗时和状态码"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        status = 500 if exc is not None else g.get('response_status', 500)
+        metrics.observe_request(request.endpoint or 'unknown', request.method, status,
+                                time.perf_counter() - started)
+    metrics.endpoint = None
+
+def collect_runtime_metrics():
+    """连接池、缓存、索引和验证码池的当前状态"""
+    pool_connections = []
+    pool_events = []
+    for pool_name, status in ldap_manager.pool_status().items():
+        for state in ('idle', 'in_use'):
+            pool_connections.append(((('pool', pool_name), ('state', state)), status[state]))
+        for event in ('created', 'reused', 'discarded', 'evicted', 'waits'):
+            pool_events.append(((('pool', pool_name), ('event', event)), status[event]))
+
+    cache = ldap_manager.identity_cache.stats()
+    return [
+        ('ldap_pool_connections', 'gauge', 'LDAP连接池中的连接数', pool_connections),
+        ('ldap_pool_events_total', 'counter', 'LDAP连接池事件数', pool_events),
+        ('identity_cache_requests_total', 'counter', '身份缓存查询数',
+         [((('result', 'hit'),), cache['hits']), ((('result', 'miss'),), cache['misses'])]),
+        ('identity_cache_entries', 'gauge', '身份缓存条目数', [((), cache['size'])]),
+        ('student_index_entries', 'gauge', '学生索引中的学生数', [((), len(ldap_manager.student_index))]),
+        ('captcha_pool_available', 'gauge', '预生成验证码可用数', [((), captcha_pool.stats()['available'])]),
+    ]
+
+metrics.register_collector(collect_runtime_metrics)
+
 def login_required(f):
     """登录验证装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
+        return current_app.ensure_sync(f)(*args, **kwargs)
+    return decorated_function
+
+def current_identity():
+    """当前登录用户的身份，每个请求只查询一次LDAP"""
+    if 'identity' not in g:
+        user_id = session.get('user_id')
+        g.identity = load_identity(ldap_manager, user_id) if user_id else None
+    return g.identity
+
+def identity_for(username):
+    """当前用户直接使用请求内缓存的身份，其他用户单独查询"""
+    identity = g.get('identity')
+    if identity is None and username == session.get('user_id'):
+        identity = current_identity()
+    if identity is not None and identity.uid == username:
+        return identity
+    return load_identity(ldap_manager, username)
+
+def admin_required(f):
+    """管理员权限装饰器（放在login_required之后）"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            identity = current_identity()
+        except Exception:
+            logger.exception('检查管理员权限错误')
+            identity = None
+        if identity is None or not identity.is_admin:
+            if request.path.startswith('/api/'):
+                return jsonify({'success': False, 'message': '权限不足！'}), 403
+            flash('您没有管理员权限！', 'error')
+            return redirect(url_for('dashboard'))
+        return current_app.ensure_sync(f)(*args, **kwargs)
     return decorated_function
 
 def no_cache(f):
     """禁用缓存装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        response = make_response(f(*args, **kwargs))
+        response = make_response(current_app.ensure_sync(f)(*args, **kwargs))
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
@@ -45,7 +181,7 @@ def index():
 
 @app.route('/login', methods=['GET', 'POST'])
 @no_cache
-def login():
+async def login():
     """登录页面"""
     if request.method == 'POST':
         username = request.form.get('username')
@@ -58,7 +194,7 @@ def login():
             return render_template('login.html', captcha=generate_captcha())
         
         # 验证用户凭据
-        if authenticate_user(username, password):
+        if await authenticate_user(username, password):
             session['user_id'] = username
             session['user_name'] = get_user_name(username)
             flash('登录成功！', 'success')
@@ -71,8 +207,21 @@ def login():
 @app.route('/captcha')
 @no_cache
 def get_captcha():
-    """获取验证码图片"""
-    return jsonify({'captcha': generate_captcha()})
+    """获取验证码图片（inline=0 时返回图片地址而不是内联的base64）"""
+    inline = request.args.get('inline')
+    return jsonify({'captcha': generate_captcha(None if inline is None else inline != '0')})
+
+@app.route('/captcha/<captcha_id>')
+def captcha_image(captcha_id):
+    """按ID返回验证码图片，同一ID的图片不变，可由浏览器私有缓存"""
+    image = get_captcha_image(captcha_id)
+    if image is None:
+        return '', 404
+    body, mimetype = image
+    response = make_response(body)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Cache-Control'] = 'private, max-age=300, immutable'
+    return response
 
 @app.route('/logout')
 def logout():
@@ -120,13 +269,8 @@ def update_profile():
     new_password = request.form.get('password')
     
     try:
-        # 连接到LDAP
-        if not ldap_manager.connect():
-            flash('连接LDAP服务器失败！', 'error')
-            return redirect(url_for('profile'))
-        
         # 更新用户信息
-        dn = f'uid={user_id},ou=students,{ldap_manager.LDAP_BASE_DN}'
+        dn = ldap_manager.student_dn(user_id)
         
         changes = {}
         if new_cn:
@@ -136,21 +280,27 @@ def update_profile():
         if new_mail:
             changes['mail'] = [(MODIFY_REPLACE, [new_mail])]
         if new_password:
-            changes['userPassword'] = [(MODIFY_REPLACE, [new_password])]
+            changes['userPassword'] = [(MODIFY_REPLACE, [hash_password(new_password)])]
         
         if changes:
-            if ldap_manager.conn.modify(dn, changes):
-                flash('个人信息更新成功！', 'success')
-                # 更新session中的用户名
-                if new_cn:
-                    session['user_name'] = new_cn
-            else:
-                flash('更新失败：' + str(ldap_manager.conn.last_error), 'error')
+            with ldap_manager.connection() as conn:
+                if conn.modify(dn, changes):
+                    flash('个人信息更新成功！', 'success')
+                    # 更新session中的用户名
+                    if new_cn:
+                        session['user_name'] = new_cn
+                    # 请求内和进程内缓存的身份已过期
+                    g.pop('identity', None)
+                    ldap_manager.identity_cache.invalidate(user_id)
+                    ldap_manager.update_index(user_id, {name: value for name, value in
+                                                        (('cn', new_cn), ('sn', new_sn), ('mail', new_mail)) if value})
+                else:
+                    flash('更新失败：' + str(conn.last_error), 'error')
         else:
             flash('没有需要更新的信息！', 'info')
         
-        ldap_manager.disconnect()
-        
+    except ConnectionError:
+        flash('连接LDAP服务器失败！', 'error')
     except Exception as e:
         flash('更新过程中发生错误：' + str(e), 'error')
     
@@ -158,20 +308,17 @@ def update_profile():
 
 @app.route('/admin')
 @login_required
+@admin_required
 @no_cache
-def admin():
+async def admin():
     """管理员页面"""
-    # 检查是否为管理员
-    if not is_admin(session.get('user_id')):
-        flash('您没有管理员权限！', 'error')
-        return redirect(url_for('dashboard'))
-    
     # 获取分页参数
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 8
     
     # 获取学生信息（支持分页）
-    result = get_all_students(page=page, per_page=per_page)
+    result = await get_all_students(page=page, per_page=per_page, cursor=cursor)
     
     return render_template('admin.html', 
                          students=result['students'], 
@@ -179,13 +326,10 @@ def admin():
 
 @app.route('/api/add_student', methods=['POST'])
 @login_required
+@admin_required
 def add_student():
     """添加学生API"""
     try:
-        # 检查是否为管理员
-        if not is_admin(session.get('user_id')):
-            return jsonify({'success': False, 'message': '权限不足！'}), 403
-        
         # 获取表单数据
         data = request.get_json()
         uid = data.get('uid', '').strip()
@@ -204,85 +348,59 @@ def add_student():
         if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', mail):
             return jsonify({'success': False, 'message': '邮箱格式不正确！'}), 400
         
-        # 连接到LDAP并添加学生
-        if not ldap_manager.connect():
-            return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
-        
-        # 检查用户是否已存在
-        dn = f'uid={uid},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        if ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)'):
-            ldap_manager.disconnect()
-            return jsonify({'success': False, 'message': f'用户ID {uid} 已存在！'}), 400
-        
-        # 添加学生
-        success = ldap_manager.add_student(uid, cn, sn, mail, password, class_name)
-        ldap_manager.disconnect()
+        # 借出LDAP连接并添加学生
+        with ldap_manager.connection() as conn:
+            # 检查用户是否已存在
+            dn = ldap_manager.student_dn(uid)
+            if conn.search(dn, '(objectClass=inetOrgPerson)'):
+                return jsonify({'success': False, 'message': f'用户ID {uid} 已存在！'}), 400
+            
+            # 添加学生
+            success = ldap_manager.add_student(uid, cn, sn, mail, password, class_name)
         
         if success:
             return jsonify({'success': True, 'message': f'学生 {uid} 添加成功！'})
         else:
             return jsonify({'success': False, 'message': '添加学生失败，请检查数据格式！'}), 500
             
+    except ConnectionError:
+        return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
     except Exception as e:
-        print(f"添加学生错误: {e}")
+        logger.exception('添加学生错误')
         return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
 @app.route('/api/get_student/<uid>')
 @login_required
-def get_student(uid):
+@admin_required
+async def get_student(uid):
     """获取学生详情API"""
     try:
-        # 检查是否为管理员
-        if not is_admin(session.get('user_id')):
-            return jsonify({'success': False, 'message': '权限不足！'}), 403
-        
-        # 连接到LDAP并查询学生
-        if not ldap_manager.connect():
-            return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
-        
-        student = ldap_manager.search_student(uid)
-        ldap_manager.disconnect()
-        
-        if student:
-            # 解析班级信息
-            class_name = "未分配"
-            if hasattr(student, 'description'):
-                desc = str(student.description)
-                if desc.startswith('班级: '):
-                    class_name = desc[3:]  # 去掉"班级: "前缀
-                elif desc.startswith('role:'):
-                    class_name = "管理员"
-            
-            student_data = {
-                'uid': str(student.uid),
-                'cn': str(student.cn),
-                'sn': str(student.sn),
-                'mail': str(student.mail),
-                'class_name': class_name
-            }
-            return jsonify({'success': True, 'data': student_data})
-        else:
+        entry = await async_ldap.get_student_entry(uid)
+        if entry is None:
             return jsonify({'success': False, 'message': '学生不存在！'}), 404
+        
+        # 验证器取自条目的 entryCSN / modifyTimestamp，服务器不提供时取自字段内容
+        student, version, modified_at = entry
+        if version is None:
+            version = '\0'.join(str(getattr(student, name)) for name in student.__slots__)
+        etag = hashlib.sha1(f'{uid}\0{version}'.encode('utf-8')).hexdigest()[:20]
+        return conditional(lambda: jsonify({'success': True, 'data': student.to_dict()}), etag, modified_at)
             
+    except ConnectionError:
+        return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
     except Exception as e:
-        print(f"获取学生详情错误: {e}")
+        logger.exception('获取学生详情错误')
         return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
 @app.route('/api/update_student/<uid>', methods=['PUT'])
 @login_required
+@admin_required
 def update_student(uid):
     """更新学生信息API"""
     try:
-        print(f"开始更新学生 {uid}")
-        
-        # 检查是否为管理员
-        if not is_admin(session.get('user_id')):
-            print("权限检查失败")
-            return jsonify({'success': False, 'message': '权限不足！'}), 403
-        
         # 获取表单数据
         data = request.get_json()
-        print(f"接收到的数据: {data}")
+        logger.debug('开始更新学生', extra=fields(uid=uid, data=data))
         
         cn = data.get('cn', '').strip()
         sn = data.get('sn', '').strip()
@@ -292,29 +410,15 @@ def update_student(uid):
         
         # 验证必填字段
         if not cn or not sn or not mail:
-            print("必填字段验证失败")
+            logger.info('必填字段验证失败', extra=fields(uid=uid))
             return jsonify({'success': False, 'message': '姓名、姓氏和邮箱不能为空！'}), 400
         
         # 验证邮箱格式
         import re
         if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', mail):
-            print("邮箱格式验证失败")
+            logger.info('邮箱格式验证失败', extra=fields(uid=uid))
             return jsonify({'success': False, 'message': '邮箱格式不正确！'}), 400
         
-        # 连接到LDAP并更新学生
-        if not ldap_manager.connect():
-            print("LDAP连接失败")
-            return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
-        
-        # 检查用户是否存在
-        dn = f'uid={uid},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        print(f"查找用户DN: {dn}")
-        
-        if not ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)'):
-            print("用户不存在")
-            ldap_manager.disconnect()
-            return jsonify({'success': False, 'message': '学生不存在！'}), 404
-        
         # 准备更新数据 - 使用字典格式
         changes = {
             'cn': [(MODIFY_REPLACE, [cn])],
@@ -323,7 +427,7 @@ def update_student(uid):
         }
         
         if password:
-            changes['userPassword'] = [(MODIFY_REPLACE, [password])]
+            changes['userPassword'] = [(MODIFY_REPLACE, [hash_password(password)])]
         
         # 更新班级信息
         if class_name:
@@ -331,250 +435,347 @@ def update_student(uid):
         else:
             changes['description'] = [(MODIFY_REPLACE, [''])]
         
-        print(f"准备执行更新: {changes}")
-        
-        # 执行更新
-        if ldap_manager.conn.modify(dn, changes):
-            print("更新成功")
-            ldap_manager.disconnect()
-            return jsonify({'success': True, 'message': f'学生 {uid} 更新成功！'})
-        else:
-            print(f"更新失败: {ldap_manager.conn.last_error}")
-            ldap_manager.disconnect()
-            return jsonify({'success': False, 'message': f'更新学生失败: {ldap_manager.conn.last_error}'}), 500
+        # 借出LDAP连接并更新学生，学生不存在时服务器返回 noSuchObject
+        with ldap_manager.connection() as conn:
+            dn = ldap_manager.student_dn(uid)
             
+            # 执行更新
+            if conn.modify(dn, changes):
+                ldap_manager.identity_cache.invalidate(uid)
+                ldap_manager.update_index(uid, {
+                    'cn': cn, 'sn': sn, 'mail': mail,
+                    'description': f'班级: {class_name}' if class_name else ''
+                })
+                ldap_manager.update_class_roster(conn, uid, class_name or None)
+                logger.info('✅ 学生信息更新成功', extra=fields(uid=uid, attributes=sorted(changes)))
+                return jsonify({'success': True, 'message': f'学生 {uid} 更新成功！'})
+            elif conn.result.get('result') == RESULT_NO_SUCH_OBJECT:
+                logger.info('学生不存在', extra=fields(uid=uid))
+                return jsonify({'success': False, 'message': '学生不存在！'}), 404
+            else:
+                logger.error('❌ 更新学生失败: %s', conn.last_error, extra=fields(uid=uid))
+                return jsonify({'success': False, 'message': f'更新学生失败: {conn.last_error}'}), 500
+            
+    except ConnectionError:
+        logger.error('❌ LDAP连接失败')
+        return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
     except Exception as e:
-        print(f"更新学生错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('❌ 更新学生错误', extra=fields(uid=uid))
         return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
 @app.route('/api/delete_student/<uid>', methods=['DELETE'])
 @login_required
+@admin_required
 def delete_student(uid):
     """删除学生API"""
     try:
-        # 检查是否为管理员
-        if not is_admin(session.get('user_id')):
-            return jsonify({'success': False, 'message': '权限不足！'}), 403
-        
-        # 连接到LDAP并删除学生
-        if not ldap_manager.connect():
-            return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
-        
-        # 检查用户是否存在
-        dn = f'uid={uid},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        if not ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)'):
-            ldap_manager.disconnect()
-            return jsonify({'success': False, 'message': '学生不存在！'}), 404
-        
-        # 执行删除
-        if ldap_manager.conn.delete(dn):
-            ldap_manager.disconnect()
-            return jsonify({'success': True, 'message': f'学生 {uid} 删除成功！'})
-        else:
-            ldap_manager.disconnect()
-            return jsonify({'success': False, 'message': '删除学生失败！'}), 500
+        # 借出LDAP连接并删除学生，学生不存在时服务器返回 noSuchObject
+        with ldap_manager.connection() as conn:
+            if ldap_manager.delete_student(uid):
+                return jsonify({'success': True, 'message': f'学生 {uid} 删除成功！'})
+            elif conn.result.get('result') == RESULT_NO_SUCH_OBJECT:
+                return jsonify({'success': False, 'message': '学生不存在！'}), 404
+            else:
+                return jsonify({'success': False, 'message': '删除学生失败！'}), 500
             
+    except ConnectionError:
+        return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
     except Exception as e:
-        print(f"删除学生错误: {e}")
+        logger.exception('删除学生错误')
         return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
-def authenticate_user(username, password):
-    """验证用户凭据"""
+def batch_response(run):
+    """执行批量操作并返回逐项结果，请求参数不合法时返回400"""
     try:
-        # 连接到LDAP服务器
-        if not ldap_manager.connect():
-            return False
+        result = run()
+        return jsonify({'success': True, 'data': result.to_dict(),
+                        'message': f'成功 {result.success_count} / {len(result.rows)} 名学生'})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except ConnectionError:
+        return jsonify({'success': False, 'message': '连接LDAP服务器失败！'}), 500
+    except Exception as e:
+        logger.exception('批量操作错误')
+        return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
+
+@app.route('/api/batch_update_students', methods=['POST'])
+@login_required
+@admin_required
+def batch_update_students():
+    """批量修改学生API：{"students": [{"uid": ..., "cn"/"sn"/"mail"/"class_name"/"password": ...}]}"""
+    data = request.get_json(silent=True) or {}
+    students = data.get('students')
+    if not isinstance(students, list) or not all(isinstance(item, dict) for item in students):
+        return jsonify({'success': False, 'message': 'students 必须是学生对象列表！'}), 400
+    return batch_response(lambda: ldap_manager.batch_update_students(students))
+
+@app.route('/api/batch_delete_students', methods=['POST'])
+@login_required
+@admin_required
+def batch_delete_students():
+    """批量删除学生API：{"uids": [...]} 或 {"class_name": "..."}，当前登录的账号不会被删除"""
+    data = request.get_json(silent=True) or {}
+    return batch_response(lambda: ldap_manager.batch_delete_students(
+        uids=data.get('uids'), class_name=data.get('class_name'), exclude={session.get('user_id')}))
+
+@app.route('/api/reassign_class', methods=['POST'])
+@login_required
+@admin_required
+def reassign_class():
+    """批量调整班级API：{"class_name": 新班级, "uids": [...]} 或 {"class_name": 新班级, "from_class": 原班级}"""
+    data = request.get_json(silent=True) or {}
+    return batch_response(lambda: ldap_manager.reassign_class(
+        data.get('class_name', ''), uids=data.get('uids'), from_class=data.get('from_class')))
+
+def conditional(build, etag, last_modified=None):
+    """带验证器的私有响应：请求中的 If-None-Match / If-Modified-Since 仍然有效时直接返回304，
+    不调用 build() 生成响应体；浏览器可以缓存但每次使用前都要重新验证
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = build()
+    else:
+        response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def json_response(payload, status=200):
+    """序列化为紧凑的JSON（优先使用 orjson），用于高频的列表接口"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return Response(body, status=status, content_type='application/json')
+
+@app.route('/api/students')
+@login_required
+@admin_required
+def list_students_api():
+    """学生列表API：cursor 或 page 翻页，fields 选择列，class_name 过滤
+
+    结果按列输出：fields 为列名，rows 为每名学生的值数组；翻到下一页时传入 pagination.next_cursor
+    """
+    per_page = max(1, min(request.args.get('per_page', 8, type=int), 100))
+    page = max(1, request.args.get('page', 1, type=int))
+    class_name = request.args.get('class_name') or None
+    cursor = request.args.get('cursor')
+    cursor_uid = decode_cursor(cursor) if cursor else None
+    if cursor and cursor_uid is None:
+        return json_response({'success': False, 'message': '无效的游标！'}, 400)
+    try:
+        columns = resolve_columns([name.strip() for name in request.args.get('fields', '').split(',') if name.strip()])
+    except ValueError as e:
+        return json_response({'success': False, 'message': str(e)}, 400)
+
+    try:
+        index = ldap_manager.ensure_index()
+    except Exception as e:
+        logger.exception('获取学生列表错误')
+        return json_response({'success': False, 'message': f'服务器错误: {str(e)}'}, 500)
+
+    def build():
+        result = index.page(page, per_page, class_name=class_name, cursor=cursor_uid)
+        getter = attrgetter(*columns)
+        if len(columns) == 1:
+            rows = [[getter(student)] for student in result['students']]
+        else:
+            rows = [getter(student) for student in result['students']]
+        return json_response({'success': True, 'fields': columns, 'rows': rows, 'pagination': result['pagination']})
+
+    # 验证器取自索引内容摘要，各工作进程内容一致时相同；同一URL的参数不同则缓存条目不同
+    return conditional(build, f'students-{index.etag}')
+
+@app.route('/api/search_students')
+@login_required
+@admin_required
+def search_students():
+    """搜索学生API：按 uid/cn 前缀或子串搜索，可按班级过滤，由进程内索引直接返回"""
+    try:
+        query = request.args.get('q', '')
+        class_name = request.args.get('class_name') or None
+        limit = min(request.args.get('limit', 50, type=int), 200)
         
-        # 搜索用户
-        dn = f'uid={username},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)', attributes=['*'])
+        index = ldap_manager.ensure_index()
         
-        if ldap_manager.conn.entries:
+        def build():
+            students = index.search(query, limit=limit, class_name=class_name)
+            return jsonify({'success': True, 'data': [student.to_dict() for student in students]})
+        
+        return conditional(build, f'search-{index.etag}')
+        
+    except Exception as e:
+        logger.exception('搜索学生错误')
+        return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
 
-            # 获取用户信息
-            student = ldap_manager.conn.entries[0]
-            stored_password = str(student.userPassword) if hasattr(student, 'userPassword') else None
-            
-            # 验证密码 - 处理多种密码格式
-            if stored_password:
-                import base64
-                import ast
-                
-                print(f"🔍 调试信息 - 用户: {username}")
-                print(f"🔍 存储的密码: {stored_password}")
-                print(f"🔍 输入的密码: {password}")
-                
-                # 处理不同的密码格式
-                actual_password = None
-                
-                try:
-                    # 情况1: 如果是字节字符串的字符串表示 (b'password')
-                    if stored_password.startswith("b'") and stored_password.endswith("'"):
-                        actual_password = ast.literal_eval(stored_password).decode('utf-8')
-                        print(f"🔍 字节字符串解码: {actual_password}")
-                    # 情况2: 如果是Base64编码
-                    elif len(stored_password) > 0 and not stored_password.startswith("b'"):
-                        try:
-                            actual_password = base64.b64decode(stored_password).decode('utf-8')
-                            print(f"🔍 Base64解码: {actual_password}")
-                        except:
-                            # 情况3: 直接是明文
-                            actual_password = stored_password
-                            print(f"🔍 明文密码: {actual_password}")
-                    else:
-                        actual_password = stored_password
-                        print(f"🔍 其他格式: {actual_password}")
-                    
-                    # 比较密码
-                    if actual_password == password:
-                        print(f"✅ 用户 {username} 认证成功")
-                        return True
-                    else:
-                        print(f"❌ 密码不匹配: 实际='{actual_password}', 输入='{password}'")
-                        
-                except Exception as e:
-                    print(f"❌ 密码处理失败: {e}")
-                    # 最后尝试直接比较
-                    if stored_password == password:
-                        print(f"✅ 用户 {username} 认证成功")
-                        return True
-                
-                print(f"❌ 密码验证失败: 用户 {username}")
-                ldap_manager.disconnect()
-                return False
-            else:
-                print(f"❌ 用户 {username} 没有设置密码")
-                ldap_manager.disconnect()
-                return False
+@app.route('/api/classes')
+@login_required
+@admin_required
+def class_statistics():
+    """班级人数统计API，读取 ou=classes 下的班级条目"""
+    counts = ldap_manager.class_counts()
+    if counts is None:
+        return jsonify({'success': False, 'message': '读取班级信息失败！'}), 500
+    data = [{'class_name': name, 'count': count} for name, count in sorted(counts.items())]
+    return jsonify({'success': True, 'data': data, 'total': sum(counts.values())})
+
+@app.route('/api/classes/<class_name>/students')
+@login_required
+@admin_required
+def class_students(class_name):
+    """班级名册API，只读取该班级条目及其成员"""
+    students = ldap_manager.class_roster(class_name)
+    if students is None:
+        return jsonify({'success': False, 'message': '班级不存在！'}), 404
+    return jsonify({'success': True, 'data': [student.to_dict() for student in students]})
+
+@app.route('/api/export_students')
+@login_required
+@admin_required
+def export_students():
+    """导出学生名册API：format=csv|xlsx，columns=uid,cn,...，class_name 可重复指定
+
+    边分页检索边输出，导出全部学生时内存占用也不随人数增长
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    columns = [name.strip() for name in request.args.get('columns', '').split(',') if name.strip()]
+    class_names = [name for name in request.args.getlist('class_name') if name] or None
+    try:
+        chunks = ldap_manager.export_students(fmt, columns or None, class_names)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    filename = f"students_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    response = Response(chunks, content_type=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # 让nginx边收边转发，不缓冲整个文件
+    response.headers['X-Accel-Buffering'] = 'no'
+    logger.info('📤 导出学生名册', extra=fields(format=fmt, columns=columns or None, class_names=class_names))
+    return response
+
+@app.route('/api/import_students', methods=['POST'])
+@login_required
+@admin_required
+def import_students():
+    """批量导入API：保存上传文件并提交后台任务，立即返回任务ID"""
+    try:
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({'success': False, 'message': '请选择要导入的文件！'}), 400
+        
+        ext = os.path.splitext(upload.filename)[1].lower()
+        if ext not in IMPORT_EXTENSIONS:
+            return jsonify({'success': False, 'message': '仅支持CSV和Excel文件！'}), 400
+        
+        fd, path = tempfile.mkstemp(suffix=ext, prefix='import_')
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+        
+        job_id = import_jobs.submit(path, upload.filename)
+        return jsonify({
+            'success': True,
+            'message': '导入任务已提交！',
+            'job_id': job_id,
+            'status_url': url_for('import_status', job_id=job_id)
+        }), 202
         
-        print(f"❌ 用户 {username} 不存在")
-        ldap_manager.disconnect()
-        return False
+    except Exception as e:
+        logger.exception('提交导入任务错误')
+        return jsonify({'success': False, 'message': f'服务器错误: {str(e)}'}), 500
+
+@app.route('/api/import_status/<job_id>')
+@login_required
+@admin_required
+def import_status(job_id):
+    """批量导入任务进度API"""
+    job = import_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '导入任务不存在！'}), 404
+    return jsonify({'success': True, 'data': job})
+
+# 抓取 /metrics 需要的 Bearer 令牌；未设置时只允许本机地址访问
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+def metrics_allowed():
+    """检查请求是否可以读取运行指标（应用直接监听公网地址时不依赖反向代理的限制）"""
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').encode('utf-8')
+        return hmac.compare_digest(supplied, f'Bearer {METRICS_TOKEN}'.encode('utf-8'))
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标"""
+    if not metrics_allowed():
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.route('/api/cache_stats')
+@login_required
+@admin_required
+def cache_stats():
+    """身份缓存、学生索引、增量同步和连接池统计API"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'identity_cache': ldap_manager.identity_cache.stats(),
+            'student_index': {'size': len(ldap_manager.student_index), 'version': ldap_manager.student_index.version},
+            'directory_sync': directory_sync.stats(),
+            'ldap_pools': ldap_manager.pool_status()
+        }
+    })
+
+async def authenticate_user(username, password):
+    """验证用户凭据：以用户自己的DN绑定LDAP，身份随同一次登录取回并供本请求复用"""
+    try:
+        identity = await async_ldap.authenticate(username, password)
+        if identity is None:
+            logger.info('❌ 用户认证失败', extra=fields(user=username))
+            return False
+
+        g.identity = identity
+        logger.info('✅ 用户认证成功', extra=fields(user=username))
+        return True
         
     except Exception as e:
-        print(f"❌ 认证错误: {e}")
-        if ldap_manager.conn:
-            ldap_manager.disconnect()
+        logger.exception('❌ 认证错误', extra=fields(user=username))
         return False
 
 def get_user_name(username):
     """获取用户姓名"""
     try:
-        if not ldap_manager.connect():
-            return '未知用户'
-        
-        dn = f'uid={username},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)', attributes=['cn', 'sn'])
-        
-        if ldap_manager.conn.entries:
-            student = ldap_manager.conn.entries[0]
-            name = str(student.cn)
-            ldap_manager.disconnect()
-            return name
-        
-        ldap_manager.disconnect()
-        return '未知用户'
+        identity = identity_for(username)
+        return identity.display_name if identity else '未知用户'
         
     except Exception as e:
-        print(f"获取用户姓名错误: {e}")
-        if ldap_manager.conn:
-            ldap_manager.disconnect()
+        logger.exception('获取用户姓名错误')
         return '未知用户'
 
 def get_user_info(username):
     """获取用户详细信息"""
     try:
-        if not ldap_manager.connect():
-            return None
-        
-        dn = f'uid={username},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)', attributes=['*'])
-        
-        if ldap_manager.conn.entries:
-            student = ldap_manager.conn.entries[0]
-            user_info = {
-                'uid': str(student.uid),
-                'cn': str(student.cn),
-                'sn': str(student.sn),
-                'mail': str(student.mail),
-                'description': str(student.description) if hasattr(student, 'description') else '未设置'
-            }
-            ldap_manager.disconnect()
-            return user_info
-        
-        ldap_manager.disconnect()
-        return None
+        identity = identity_for(username)
+        return identity.to_user_info() if identity else None
         
     except Exception as e:
-        print(f"获取用户信息错误: {e}")
-        if ldap_manager.conn:
-            ldap_manager.disconnect()
+        logger.exception('获取用户信息错误')
         return None
 
-def get_all_students(page=1, per_page=8):
-    """获取学生信息（支持分页）"""
-    try:
-        if not ldap_manager.connect():
-            return {
-                'students': [],
-                'pagination': {
-                    'page': 1,
-                    'per_page': per_page,
-                    'total': 0,
-                    'total_pages': 0,
-                    'has_prev': False,
-                    'has_next': False,
-                    'prev_page': None,
-                    'next_page': None
-                }
-            }
-        
-        result = ldap_manager.list_students(page=page, per_page=per_page)
-        ldap_manager.disconnect()
-        return result
-        
-    except Exception as e:
-        print(f"获取学生列表错误: {e}")
-        return {
-            'students': [],
-            'pagination': {
-                'page': 1,
-                'per_page': per_page,
-                'total': 0,
-                'total_pages': 0,
-                'has_prev': False,
-                'has_next': False,
-                'prev_page': None,
-                'next_page': None
-            }
-        }
-
-def is_admin(username):
-    """检查是否为管理员"""
+async def get_all_students(page=1, per_page=8, cursor=None):
+    """获取学生信息（支持分页和游标翻页），从进程内学生索引读取"""
     try:
-        if not ldap_manager.connect():
-            return False
-        
-        # 查询用户信息
-        dn = f'uid={username},ou=students,{ldap_manager.LDAP_BASE_DN}'
-        ldap_manager.conn.search(dn, '(objectClass=inetOrgPerson)', attributes=['description'])
-        
-        if ldap_manager.conn.entries:
-            user = ldap_manager.conn.entries[0]
-            # 检查description字段中的角色信息
-            if hasattr(user, 'description'):
-                description = str(user.description).lower()
-                ldap_manager.disconnect()
-                return 'role:admin' in description
-        
-        ldap_manager.disconnect()
-        return False
+        cursor_uid = decode_cursor(cursor) if cursor else None
+        return await async_ldap.page(page, per_page, cursor=cursor_uid)
         
     except Exception as e:
-        print(f"检查管理员权限错误: {e}")
-        return False
+        logger.exception('获取学生列表错误')
+        return empty_page(per_page)
 
 if __name__ == '__main__':
     # 确保templates目录存在
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+用 ldap3 的 MOCK_SYNC 策略在进程内模拟LDAP目录，按 students_sample.csv 的列结构生成
+1k/10k/100k 名合成学生，测量 StudentLDAPManager 和 Flask 路由的吞吐量与 p50/p95/p99 延迟，
+结果写成JSON，便于不依赖真实 slapd 比较前后两次运行
+
+python benchmark.py --sizes 1000,10000 --output bench.json
+python benchmark.py --sizes 1000 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_SLAPD_2_4
+
+# 基准测试只关心耗时，日志只保留警告以上
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app as webapp
+from credentials import hash_password, is_hashed, verify_password
+from ldap_pool import LDAPConnectionPool
+from metrics import InstrumentedConnection
+from student_index import StudentIndex
+from student_paging import StudentPager
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'students_sample.csv')
+ADMIN_UID = 'admin'
+MOCK_ADMIN_PASSWORD = 'benchmark'
+DEFAULT_PASSWORD = '123456'
+GIVEN_NAMES = ['伟', '芳', '娜', '敏', '静', '磊', '洋', '艳', '勇', '军', '杰', '娟', '涛', '明', '超', '霞']
+
+DEFAULT_SCENARIOS = ['login', 'admin_page', 'get_student', 'update_student', 'captcha', 'csv_import']
+
+
+# ---- 数据和模拟目录 ----
+
+class HashVerifyingConnection(InstrumentedConnection):
+    """模拟目录的连接：绑定时像 slapd 一样按 {SCHEME} 校验 userPassword
+
+    ldap3 的模拟策略只按原值比较密码，目录中是哈希时无法绑定；这里只替换模拟服务器一侧的比较，
+    被测的登录、哈希升级和认证连接池都按真实路径执行
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        equal = self.strategy.equal
+
+        def hashed_equal(dn, attribute_type, value):
+            if attribute_type == 'userPassword':
+                password = value.decode('utf-8') if isinstance(value, bytes) else str(value)
+                for stored in self.server.dit[dn][attribute_type]:
+                    stored = stored.decode('utf-8', 'replace') if isinstance(stored, bytes) else str(stored)
+                    if is_hashed(stored) and verify_password(password, stored):
+                        return True
+            return equal(dn, attribute_type, value)
+
+        self.strategy.equal = hashed_equal
+
+
+def synthetic_students(n, seed=0, start=0):
+    """按样例CSV的列结构生成 n 名学生，相同 seed 生成的数据完全相同"""
+    sample = pd.read_csv(SAMPLE_CSV, dtype=str, keep_default_na=False)
+    surnames = sorted(set(sample['sn'])) or ['张']
+    classes = sorted(set(sample['class_name'])) or ['计算机2021-1班']
+    rng = random.Random(seed + start)
+    for i in range(start, start + n):
+        sn = rng.choice(surnames)
+        uid = f'bench{i:06d}'
+        yield {
+            'uid': uid,
+            'cn': sn + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES),
+            'sn': sn,
+            'mail': f'{uid}@szuldpa-edu.com',
+            'password': DEFAULT_PASSWORD,
+            'class_name': rng.choice(classes)
+        }
+
+
+def attach_mock_directory(manager, students):
+    """为 manager 建立一个新的模拟目录并重置所有进程内缓存，返回学生数"""
+    manager.close_pool()
+    server = Server('benchmark', get_info=OFFLINE_SLAPD_2_4)
+    seed = Connection(server, user=manager.LDAP_ADMIN_DN, password=MOCK_ADMIN_PASSWORD, client_strategy=MOCK_SYNC)
+    seed.strategy.add_entry(manager.LDAP_ADMIN_DN, {'objectClass': ['person'], 'cn': 'admin', 'sn': 'admin',
+                                                    'userPassword': MOCK_ADMIN_PASSWORD})
+    seed.strategy.add_entry(f'ou=students,{manager.LDAP_BASE_DN}', {'objectClass': ['organizationalUnit'], 'ou': 'students'})
+    seed.strategy.add_entry(manager.student_dn(ADMIN_UID), {
+        'objectClass': ['inetOrgPerson'], 'uid': ADMIN_UID, 'cn': '管理员', 'sn': '管理员',
+        'mail': 'admin@szuldpa-edu.com', 'userPassword': hash_password(DEFAULT_PASSWORD), 'description': 'role:admin'})
+
+    count = 0
+    for student in students:
+        # 与迁移后的目录一致，以当前方案的哈希写入；登录时不需要升级
+        attributes = manager.student_attributes(student['uid'], student['cn'], student['sn'], student['mail'],
+                                                class_name=student['class_name'],
+                                                password_hash=hash_password(student['password']))
+        seed.strategy.add_entry(manager.student_dn(student['uid']), attributes)
+        count += 1
+
+    manager.LDAP_ADMIN_PASSWORD = MOCK_ADMIN_PASSWORD
+    manager._pool = LDAPConnectionPool(manager.LDAP_SERVER, manager.LDAP_ADMIN_DN, MOCK_ADMIN_PASSWORD,
+                                       size=manager.LDAP_POOL_SIZE, client_strategy=MOCK_SYNC, server=server,
+                                       connection_class=HashVerifyingConnection)
+    # 认证连接池在第一次登录时按新的模拟服务器和连接类重新创建
+    manager._auth_pool = None
+    manager._legacy_misses.clear()
+    manager._pager = StudentPager(ttl=manager.LDAP_LIST_CACHE_TTL)
+    manager.student_index = StudentIndex()
+    manager.identity_cache.clear()
+    return count
+
+
+# ---- 计时 ----
+
+def percentile(sorted_values, q):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(durations, errors, items=None):
+    durations = sorted(durations)
+    total = sum(durations)
+    result = {
+        'count': len(durations),
+        'errors': errors,
+        'total_s': round(total, 4),
+        'throughput_per_s': round(len(durations) / total, 2) if total else 0.0,
+        'mean_ms': round(total / len(durations) * 1000, 3) if durations else 0.0,
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3)
+    }
+    if items is not None:
+        result['items_per_s'] = round(items / total, 1) if total else 0.0
+    return result
+
+
+def run_scenario(step, iterations, warmup):
+    """执行 warmup 次预热和 iterations 次计时调用，step(i) 返回 False 表示出错"""
+    for i in range(warmup):
+        step(-1 - i)
+    durations = []
+    errors = 0
+    for i in range(iterations):
+        started = time.perf_counter()
+        try:
+            ok = step(i)
+        except Exception:
+            ok = False
+        durations.append(time.perf_counter() - started)
+        if ok is False:
+            errors += 1
+    return durations, errors
+
+
+# ---- 场景 ----
+
+def write_import_files(size, import_rows, import_runs, seed):
+    """预先生成CSV导入文件，文件生成不计入导入耗时"""
+    paths = []
+    for run in range(import_runs):
+        fd, path = tempfile.mkstemp(suffix='.csv', prefix='bench_import_')
+        os.close(fd)
+        students = synthetic_students(import_rows, seed=seed, start=size + run * import_rows)
+        pd.DataFrame(list(students)).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def make_scenarios(client, size, rng, import_files, import_rows):
+    manager = webapp.ldap_manager
+    per_page = 8
+    pages = max(1, (size + 1 + per_page - 1) // per_page)
+
+    def random_uid():
+        return f'bench{rng.randrange(size):06d}'
+
+    def login(i):
+        with client.session_transaction() as sess:
+            sess.clear()
+            sess['captcha'] = 'ABCD'
+        response = client.post('/login', data={'username': random_uid(), 'password': DEFAULT_PASSWORD, 'captcha': 'abcd'})
+        return response.status_code == 302 and '/dashboard' in response.headers.get('Location', '')
+
+    def as_admin():
+        with client.session_transaction() as sess:
+            sess['user_id'] = ADMIN_UID
+            sess['user_name'] = '管理员'
+
+    def admin_page(i):
+        return client.get(f'/admin?page={rng.randint(1, pages)}').status_code == 200
+
+    def get_student(i):
+        return client.get(f'/api/get_student/{random_uid()}').status_code == 200
+
+    def update_student(i):
+        uid = random_uid()
+        response = client.put(f'/api/update_student/{uid}', json={
+            'cn': f'更新{i}', 'sn': '更', 'mail': f'{uid}@szuldpa-edu.com', 'class_name': '计算机2021-1班'})
+        return response.status_code == 200
+
+    def captcha(i):
+        return client.get('/captcha').status_code == 200
+
+    def csv_import(i):
+        report = manager.import_students_from_csv(import_files[i], stream=True)
+        return report is not False and report.success_count == import_rows
+
+    return {
+        'login': (login, None),
+        'admin_page': (admin_page, as_admin),
+        'get_student': (get_student, as_admin),
+        'update_student': (update_student, as_admin),
+        'captcha': (captcha, None),
+        'csv_import': (csv_import, None)
+    }
+
+
+def check_pool_release(manager):
+    """回归检查：读到一半就关闭的导出生成器必须归还连接，计时结束后连接池不应有借出的连接"""
+    export = manager.export_students()
+    next(export)
+    export.close()
+    in_use = manager.pool.status()['in_use']
+    if in_use:
+        raise RuntimeError(f'连接池仍有 {in_use} 个连接未归还')
+
+
+def benchmark_size(size, scenarios, iterations, warmup, import_rows, import_runs, seed):
+    webapp.app.config['TESTING'] = True
+    # 后台同步线程会在计时期间访问目录，基准测试中关闭
+    webapp.directory_sync.interval = 0
+
+    started = time.perf_counter()
+    count = attach_mock_directory(webapp.ldap_manager, synthetic_students(size, seed=seed))
+    seed_seconds = time.perf_counter() - started
+
+    client = webapp.app.test_client()
+    rng = random.Random(seed)
+    import_files = write_import_files(size, import_rows, import_runs, seed) if 'csv_import' in scenarios else []
+    steps = make_scenarios(client, size, rng, import_files, import_rows)
+
+    results = {'students': count, 'seed_s': round(seed_seconds, 3)}
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for name in scenarios:
+                step, setup = steps[name]
+                if setup:
+                    setup()
+                if name == 'csv_import':
+                    durations, errors = run_scenario(step, import_runs, 0)
+                    results[name] = summarize(durations, errors, items=import_rows * import_runs)
+                    results[name]['rows_per_run'] = import_rows
+                else:
+                    durations, errors = run_scenario(step, iterations, warmup)
+                    results[name] = summarize(durations, errors)
+    finally:
+        for path in import_files:
+            os.remove(path)
+    check_pool_release(webapp.ldap_manager)
+    return results
+
+
+# ---- 报告 ----
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def print_table(results):
+    print(f"{'规模':>8}  {'场景':<16}{'次数':>6}{'错误':>6}{'吞吐(/s)':>11}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for size, by_scenario in results.items():
+        for name, item in by_scenario.items():
+            if not isinstance(item, dict):
+                continue
+            print(f"{size:>8}  {name:<16}{item['count']:>6}{item['errors']:>6}{item['throughput_per_s']:>11}"
+                  f"{item['p50_ms']:>10}{item['p95_ms']:>10}{item['p99_ms']:>10}")
+
+
+def print_comparison(baseline, current):
+    """与之前的结果逐项比较 p50/p95，比值大于1表示变慢"""
+    print(f"\n{'规模':>8}  {'场景':<16}{'p50 旧→新(ms)':>24}{'比值':>8}{'p95 旧→新(ms)':>24}{'比值':>8}")
+    for size, by_scenario in current.items():
+        old_scenarios = baseline.get(size, {})
+        for name, item in by_scenario.items():
+            old = old_scenarios.get(name)
+            if not isinstance(item, dict) or not isinstance(old, dict):
+                continue
+            p50_ratio = item['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 0.0
+            p95_ratio = item['p95_ms'] / old['p95_ms'] if old['p95_ms'] else 0.0
+            print(f"{size:>8}  {name:<16}{old['p50_ms']:>11} → {item['p50_ms']:<10}{p50_ratio:>8.2f}"
+                  f"{old['p95_ms']:>11} → {item['p95_ms']:<10}{p95_ratio:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='学生LDAP系统基准测试（MOCK_SYNC 模拟目录）')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='学生数量，逗号分隔')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS), help='要运行的场景，逗号分隔')
+    parser.add_argument('--iterations', type=int, default=200, help='每个场景的计时调用次数')
+    parser.add_argument('--warmup', type=int, default=20, help='每个场景的预热调用次数')
+    parser.add_argument('--import-rows', type=int, default=1000, help='每次CSV导入的行数')
+    parser.add_argument('--import-runs', type=int, default=3, help='CSV导入的重复次数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON结果文件')
+    parser.add_argument('--compare', help='与之前的JSON结果比较')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(DEFAULT_SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for size in sizes:
+        print(f"⏱️ 规模 {size} ...", file=sys.stderr)
+        results[str(size)] = benchmark_size(size, scenarios, args.iterations, args.warmup,
+                                            args.import_rows, args.import_runs, args.seed)
+
+    report = {
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_table(results)
+    print(f"\n📁 结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,67 @@
 # -*- coding: utf-8 -*-
 """
 验证码生成工具
+验证码图片由后台线程预先生成并放入有界缓冲池，请求时直接取出；
+安装了NumPy时干扰线和噪点用数组运算一次生成，输出格式可选
 """
 
 import random
+import secrets
 import string
+import threading
+import time
+from collections import deque
 from PIL import Image, ImageDraw, ImageFont
 import io
 import base64
-from flask import session
+import os
+from flask import session, url_for
+from ttl_cache import TTLCache
+from log_utils import get_logger
+
+logger = get_logger('captcha')
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 验证码配置
+CAPTCHA_RENDERER = os.getenv('CAPTCHA_RENDERER', 'numpy' if np is not None else 'pil')
+CAPTCHA_FORMAT = os.getenv('CAPTCHA_FORMAT', 'png8')
+CAPTCHA_INLINE = os.getenv('CAPTCHA_INLINE', '1') == '1'
+CAPTCHA_PNG_COMPRESS_LEVEL = 6  # 调色板PNG在该级别下体积与耗时最均衡
+
+_palette_image = None
+
+def get_palette_image():
+    """固定的64色调色板（每通道4级），量化时无需逐张计算调色板"""
+    global _palette_image
+    if _palette_image is None:
+        levels = (0, 85, 170, 255)
+        palette = Image.new('P', (1, 1))
+        palette.putpalette([c for r in levels for g in levels for b in levels for c in (r, g, b)])
+        _palette_image = palette
+    return _palette_image
+
+_font = None
+_font_lock = threading.Lock()
+
+def get_font():
+    """加载验证码字体（每个进程只加载一次）"""
+    global _font
+    if _font is None:
+        with _font_lock:
+            if _font is None:
+                # 尝试使用系统字体，如果失败则使用默认字体
+                try:
+                    _font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 24)
+                except:
+                    try:
+                        _font = ImageFont.truetype('/System/Library/Fonts/Arial.ttf', 24)
+                    except:
+                        _font = ImageFont.load_default()
+    return _font
 
 def generate_captcha_text(length=4):
     """生成验证码文本"""
@@ -19,62 +72,233 @@ def generate_captcha_text(length=4):
     chars = chars.replace('0', '').replace('O', '').replace('1', '').replace('I', '')
     return ''.join(random.choice(chars) for _ in range(length))
 
-def create_captcha_image(text, width=120, height=40):
+def create_captcha_image(text, width=120, height=40, seed=None):
     """创建验证码图片"""
+    rng = random.Random(seed) if seed is not None else random
+    
     # 创建图片
     img = Image.new('RGB', (width, height), color='white')
     draw = ImageDraw.Draw(img)
     
-    # 尝试使用系统字体，如果失败则使用默认字体
-    try:
-        font = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 24)
-    except:
-        try:
-            font = ImageFont.truetype('/System/Library/Fonts/Arial.ttf', 24)
-        except:
-            font = ImageFont.load_default()
+    font = get_font()
     
     # 绘制背景干扰线
     for _ in range(5):
-        x1 = random.randint(0, width)
-        y1 = random.randint(0, height)
-        x2 = random.randint(0, width)
-        y2 = random.randint(0, height)
-        draw.line([(x1, y1), (x2, y2)], fill=(random.randint(100, 255), random.randint(100, 255), random.randint(100, 255)), width=1)
+        x1 = rng.randint(0, width)
+        y1 = rng.randint(0, height)
+        x2 = rng.randint(0, width)
+        y2 = rng.randint(0, height)
+        draw.line([(x1, y1), (x2, y2)], fill=(rng.randint(100, 255), rng.randint(100, 255), rng.randint(100, 255)), width=1)
     
     # 绘制验证码文字
     char_width = width // len(text)
     for i, char in enumerate(text):
-        x = i * char_width + random.randint(5, 15)
-        y = random.randint(5, 15)
-        color = (random.randint(0, 100), random.randint(0, 100), random.randint(0, 100))
+        x = i * char_width + rng.randint(5, 15)
+        y = rng.randint(5, 15)
+        color = (rng.randint(0, 100), rng.randint(0, 100), rng.randint(0, 100))
         draw.text((x, y), char, font=font, fill=color)
     
     # 添加噪点
     for _ in range(100):
-        x = random.randint(0, width)
-        y = random.randint(0, height)
-        draw.point((x, y), fill=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+        x = rng.randint(0, width)
+        y = rng.randint(0, height)
+        draw.point((x, y), fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
     
     return img
 
-def generate_captcha():
-    """生成验证码并返回base64编码的图片"""
+_glyphs = {}
+
+def get_glyph(char):
+    """字符的alpha遮罩及其相对绘制原点的偏移（每个进程每个字符只光栅化一次）"""
+    glyph = _glyphs.get(char)
+    if glyph is None:
+        font = get_font()
+        left, top, right, bottom = font.getbbox(char)
+        mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+        alpha = np.asarray(mask, dtype=np.float32)[:, :, None] / 255.0
+        glyph = _glyphs[char] = (alpha, left, top)
+    return glyph
+
+def create_captcha_image_fast(text, width=120, height=40, seed=None, lines=5, noise=100):
+    """创建验证码图片（NumPy版）
+
+    干扰线的全部采样点、文字和噪点都直接写入同一个像素数组：
+    干扰线和噪点各一次数组赋值，文字用缓存的字形遮罩做alpha混合，最后只转换一次图片
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+    
+    # 绘制背景干扰线：所有线段的采样点一次算出
+    ends = rng.integers(0, (width, height, width, height), size=(lines, 4))
+    steps = np.linspace(0.0, 1.0, max(width, height))[None, :]
+    xs = np.rint(ends[:, 0:1] + (ends[:, 2:3] - ends[:, 0:1]) * steps).astype(np.intp).ravel()
+    ys = np.rint(ends[:, 1:2] + (ends[:, 3:4] - ends[:, 1:2]) * steps).astype(np.intp).ravel()
+    line_colors = rng.integers(100, 256, size=(lines, 3), dtype=np.uint8)
+    pixels[ys.clip(0, height - 1), xs.clip(0, width - 1)] = np.repeat(line_colors, steps.shape[1], axis=0)
+    
+    # 绘制验证码文字
+    char_width = width // len(text)
+    offsets = rng.integers(5, 16, size=(len(text), 2))
+    colors = rng.integers(0, 101, size=(len(text), 3)).astype(np.float32)
+    for i, char in enumerate(text):
+        alpha, left, top = get_glyph(char)
+        x0 = i * char_width + int(offsets[i, 0]) + left
+        y0 = int(offsets[i, 1]) + top
+        x1 = min(x0 + alpha.shape[1], width)
+        y1 = min(y0 + alpha.shape[0], height)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        a = alpha[:y1 - y0, :x1 - x0]
+        region = pixels[y0:y1, x0:x1]
+        region[:] = region * (1.0 - a) + colors[i] * a
+    
+    # 添加噪点
+    nx = rng.integers(0, width, noise)
+    ny = rng.integers(0, height, noise)
+    pixels[ny, nx] = rng.integers(0, 256, size=(noise, 3), dtype=np.uint8)
+    
+    return Image.fromarray(pixels)
+
+def encode_image(img, fmt=None):
+    """按指定格式编码图片，返回 (字节, MIME类型)
+
+    - png: 原始RGB PNG
+    - png8: 固定64色调色板PNG（默认，体积约为RGB PNG的40%）
+    - gif: 固定64色调色板GIF
+    - webp: 无损WebP
+    """
+    fmt = fmt or CAPTCHA_FORMAT
+    buffer = io.BytesIO()
+    if fmt == 'png8':
+        img.quantize(palette=get_palette_image(), dither=Image.Dither.NONE).save(
+            buffer, format='PNG', compress_level=CAPTCHA_PNG_COMPRESS_LEVEL)
+        mimetype = 'image/png'
+    elif fmt == 'gif':
+        img.quantize(palette=get_palette_image(), dither=Image.Dither.NONE).save(buffer, format='GIF')
+        mimetype = 'image/gif'
+    elif fmt == 'webp':
+        img.save(buffer, format='WEBP', lossless=True, method=0)
+        mimetype = 'image/webp'
+    else:
+        img.save(buffer, format='PNG')
+        mimetype = 'image/png'
+    return buffer.getvalue(), mimetype
+
+def to_data_uri(body, mimetype):
+    """转换为可内联的base64 data URI"""
+    return f"data:{mimetype};base64,{base64.b64encode(body).decode()}"
+
+def draw_captcha(text, seed, renderer=None):
+    """按渲染器绘制验证码图片；相同的文本和种子得到相同的图片"""
+    renderer = renderer or CAPTCHA_RENDERER
+    if renderer == 'numpy' and np is not None:
+        return create_captcha_image_fast(text, seed=seed)
+    return create_captcha_image(text, seed=seed)
+
+def render_captcha(renderer=None, fmt=None):
+    """生成一个验证码，返回 (验证码ID, 文本, 图片字节, MIME类型)"""
+    # 验证码ID同时作为图片的随机种子，必要时可按ID重新绘制出同一张图片
+    captcha_id = secrets.token_hex(8)
+    
     # 生成验证码文本
     captcha_text = generate_captcha_text()
     
+    # 创建验证码图片
+    img = draw_captcha(captcha_text, int(captcha_id, 16), renderer)
+    body, mimetype = encode_image(img, fmt)
+    
+    return captcha_id, captcha_text, body, mimetype
+
+class CaptchaPool:
+    """预生成验证码的有界缓冲池
+
+    后台线程在池中数量低于 low_watermark 时补充到 size，
+    取用为 O(1) 操作；池为空时退化为同步生成
+    """
+
+    def __init__(self, size=64, low_watermark=None, renderer=render_captcha):
+        self.size = size
+        self.low_watermark = size // 2 if low_watermark is None else low_watermark
+        self.renderer = renderer
+        self._items = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refill_loop, name='captcha-refill', daemon=True)
+                    self._thread.start()
+
+    def _refill_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._items) < self.size:
+                try:
+                    self._items.append(self.renderer())
+                except Exception:
+                    logger.exception('❌ 预生成验证码失败')
+                    break
+
+    def get(self):
+        """取出一个预生成的验证码"""
+        self._ensure_worker()
+        try:
+            item = self._items.popleft()
+            self.hits += 1
+        except IndexError:
+            item = self.renderer()
+            self.misses += 1
+        if len(self._items) < self.low_watermark:
+            self._wakeup.set()
+        return item
+
+    def stats(self):
+        return {'size': self.size, 'available': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+captcha_pool = CaptchaPool(size=int(os.getenv('CAPTCHA_POOL_SIZE', '64')))
+
+# 以ID方式下发的验证码图片，供 /captcha/<id> 直接返回
+_issued_images = TTLCache(maxsize=4096, ttl=300)
+
+def generate_captcha(inline=None):
+    """生成验证码，返回可直接用作 img src 的地址
+
+    inline=True 返回base64 data URI；inline=False 返回按ID获取图片的URL，
+    图片不再内联在HTML/JSON中，浏览器可以按ID缓存
+    """
+    inline = CAPTCHA_INLINE if inline is None else inline
+    captcha_id, captcha_text, body, mimetype = captcha_pool.get()
+    
     # 将验证码文本存储到session中
     session['captcha'] = captcha_text.lower()
+    session['captcha_id'] = captcha_id
     
-    # 创建验证码图片
-    img = create_captcha_image(captcha_text)
+    if inline:
+        return to_data_uri(body, mimetype)
+    _issued_images.set(captcha_id, (body, mimetype))
+    return url_for('captcha_image', captcha_id=captcha_id)
+
+def get_captcha_image(captcha_id):
+    """返回当前会话验证码的 (图片字节, MIME类型)，ID不匹配时返回 None
+
+    其他进程下发的验证码不在本进程缓存中，按ID种子和会话中的文本重新绘制同一张图片
+    """
+    if not captcha_id or session.get('captcha_id') != captcha_id or 'captcha' not in session:
+        return None
     
-    # 转换为base64编码
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    cached = _issued_images.get(captcha_id)
+    if cached is not None:
+        return cached
     
-    return f"data:image/png;base64,{img_str}"
+    img = draw_captcha(session['captcha'].upper(), int(captcha_id, 16))
+    return encode_image(img)
 
 def verify_captcha(user_input):
     """验证用户输入的验证码"""
@@ -89,5 +313,31 @@ def verify_captcha(user_input):
     
     # 验证后清除session中的验证码（无论成功失败都清除）
     session.pop('captcha', None)
+    session.pop('captcha_id', None)
     
     return is_valid
+
+def benchmark_captcha(rounds=500):
+    """验证码生成微基准：比较各渲染器和输出格式的单次耗时与体积"""
+    results = []
+    renderers = ['pil'] + (['numpy'] if np is not None else [])
+    for renderer in renderers:
+        for fmt in ('png', 'png8', 'gif', 'webp'):
+            sizes = 0
+            started = time.perf_counter()
+            for _ in range(rounds):
+                sizes += len(render_captcha(renderer, fmt)[2])
+            elapsed = time.perf_counter() - started
+            results.append({
+                'renderer': renderer,
+                'format': fmt,
+                'ms_per_captcha': round(elapsed / rounds * 1000, 3),
+                'bytes': sizes // rounds,
+                'base64_bytes': (sizes // rounds + 2) // 3 * 4
+            })
+    return results
+
+if __name__ == '__main__':
+    print(f"{'渲染器':<8}{'格式':<8}{'耗时(ms)':>10}{'字节':>8}{'base64':>8}")
+    for item in benchmark_captcha():
+        print(f"{item['renderer']:<8}{item['format']:<8}{item['ms_per_captcha']:>10}{item['bytes']:>8}{item['base64_bytes']:>8}")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+班级名册
+在 ou=classes 下为每个班级维护一个 groupOfNames 条目，member 为学生DN；
+查询某班成员或统计各班人数只需读取班级条目，不必扫描 ou=students 并逐条解析 description
+"""
+
+import string
+from ldap3 import BASE, LEVEL, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.core.results import (RESULT_NO_SUCH_OBJECT, RESULT_ENTRY_ALREADY_EXISTS,
+                                RESULT_ATTRIBUTE_OR_VALUE_EXISTS, RESULT_NO_SUCH_ATTRIBUTE,
+                                RESULT_OBJECT_CLASS_VIOLATION)
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import escape_rdn, parse_dn
+from student_record import UNASSIGNED_CLASS, ADMIN_CLASS
+
+GROUP_FILTER = '(objectClass=groupOfNames)'
+# 全部班级条目按学生的 description 重建过一次后写在 ou=classes 上的标记，
+# 没有该标记时班级条目可能只覆盖部署后经本应用写入的学生
+BUILT_MARKER = '班级名册已建立'
+
+
+def is_real_class(class_name):
+    """未分配和管理员不是实际的班级，不建班级条目"""
+    return bool(class_name) and class_name not in (UNASSIGNED_CLASS, ADMIN_CLASS)
+
+
+def unescape_rdn(value):
+    """escape_rdn 的逆运算：去掉反斜杠转义，\\XX 形式按UTF-8字节还原"""
+    if '\\' not in value:
+        return value
+    data = bytearray()
+    i = 0
+    while i < len(value):
+        if value[i] == '\\' and i + 1 < len(value):
+            pair = value[i + 1:i + 3]
+            if len(pair) == 2 and all(c in string.hexdigits for c in pair):
+                data.append(int(pair, 16))
+                i += 3
+                continue
+            i += 1
+        data += value[i].encode('utf-8')
+        i += 1
+    return data.decode('utf-8', 'replace')
+
+
+def member_uid(dn):
+    """从学生DN取出uid，如 uid=student001,ou=students,... -> student001"""
+    try:
+        attribute, value, _ = parse_dn(dn)[0]
+    except Exception:
+        return None
+    return unescape_rdn(value) if attribute.lower() == 'uid' else None
+
+
+def _values(raw_attributes, name):
+    return [value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+            for value in raw_attributes.get(name, [])]
+
+
+class ClassRosters:
+    """班级 groupOfNames 条目的读写，所有方法都使用调用方借出的连接"""
+
+    def __init__(self, base_dn):
+        self.base = f'ou=classes,{base_dn}'
+
+    def is_built(self, conn):
+        """ou=classes 上是否有重建完成的标记（一次基准检索）"""
+        marker = f'(description={escape_filter_chars(BUILT_MARKER)})'
+        if not conn.search(self.base, marker, search_scope=BASE, attributes=['ou']):
+            return False
+        return any(item.get('type') == 'searchResEntry' for item in conn.response)
+
+    def mark_built(self, conn):
+        """写入重建完成的标记"""
+        if conn.modify(self.base, {'description': [(MODIFY_ADD, [BUILT_MARKER])]}):
+            return True
+        return conn.result.get('result') == RESULT_ATTRIBUTE_OR_VALUE_EXISTS
+
+    def clear_built(self, conn):
+        """重建开始前去掉标记（中途失败时下次仍会重建），ou=classes 不存在时创建"""
+        if conn.modify(self.base, {'description': [(MODIFY_DELETE, [BUILT_MARKER])]}):
+            return True
+        result = conn.result.get('result')
+        if result == RESULT_NO_SUCH_OBJECT:
+            return conn.add(self.base, ['organizationalUnit'], {'ou': 'classes'})
+        return result == RESULT_NO_SUCH_ATTRIBUTE
+
+    def class_dn(self, class_name):
+        return f'cn={escape_rdn(class_name)},{self.base}'
+
+    def add_members(self, conn, class_name, member_dns):
+        """把一组学生加入班级，班级条目不存在时创建；已是成员的学生忽略"""
+        member_dns = list(member_dns)
+        if not is_real_class(class_name) or not member_dns:
+            return True
+        dn = self.class_dn(class_name)
+        if conn.modify(dn, {'member': [(MODIFY_ADD, member_dns)]}):
+            return True
+        result = conn.result.get('result')
+        if result == RESULT_NO_SUCH_OBJECT:
+            if conn.add(dn, ['groupOfNames'], {'cn': class_name, 'member': member_dns}):
+                return True
+            if conn.result.get('result') != RESULT_ENTRY_ALREADY_EXISTS:
+                return False
+            # 另一个线程刚创建了该班级，改为追加成员
+            return self.add_members(conn, class_name, member_dns)
+        if result == RESULT_ATTRIBUTE_OR_VALUE_EXISTS and len(member_dns) > 1:
+            # 一次修改中只要有一个值已存在就整体失败，逐个补加
+            return all(self.add_members(conn, class_name, [member]) for member in member_dns)
+        return result == RESULT_ATTRIBUTE_OR_VALUE_EXISTS
+
+    def remove_member(self, conn, class_name, member_dn):
+        """把学生移出班级，移出最后一名成员时删除班级条目（groupOfNames 要求至少一个 member）"""
+        if not is_real_class(class_name):
+            return True
+        dn = self.class_dn(class_name)
+        if conn.modify(dn, {'member': [(MODIFY_DELETE, [member_dn])]}):
+            return True
+        result = conn.result.get('result')
+        if result == RESULT_OBJECT_CLASS_VIOLATION:
+            return conn.delete(dn)
+        return result in (RESULT_NO_SUCH_OBJECT, RESULT_NO_SUCH_ATTRIBUTE)
+
+    def move_member(self, conn, old_class, new_class, member_dn):
+        """学生换班：已知原班级时直接移出再加入"""
+        if old_class == new_class:
+            return True
+        removed = self.remove_member(conn, old_class, member_dn)
+        return self.add_members(conn, new_class, [member_dn]) and removed
+
+    def memberships(self, conn, member_dn):
+        """学生当前所在的班级名称列表（按 member 等值过滤，一次单层检索）"""
+        search_filter = f'(&{GROUP_FILTER}(member={escape_filter_chars(member_dn)}))'
+        if not conn.search(self.base, search_filter, search_scope=LEVEL, attributes=['cn']):
+            return []
+        return [_values(item['raw_attributes'], 'cn')[0] for item in conn.response
+                if item.get('type') == 'searchResEntry' and item['raw_attributes'].get('cn')]
+
+    def set_class(self, conn, member_dn, class_name):
+        """原班级未知时同步学生的班级归属，class_name 为 None 或未分配时只移出"""
+        current = self.memberships(conn, member_dn)
+        ok = True
+        for name in current:
+            if name != class_name:
+                ok = self.remove_member(conn, name, member_dn) and ok
+        if is_real_class(class_name) and class_name not in current:
+            ok = self.add_members(conn, class_name, [member_dn]) and ok
+        return ok
+
+    def members(self, conn, class_name):
+        """班级成员的uid列表（按uid排序），班级不存在时返回 None；只读一次班级条目"""
+        if not conn.search(self.class_dn(class_name), GROUP_FILTER, search_scope=BASE, attributes=['member']):
+            return None
+        entries = [item for item in conn.response if item.get('type') == 'searchResEntry']
+        if not entries:
+            return None
+        uids = (member_uid(dn) for dn in _values(entries[0]['raw_attributes'], 'member'))
+        return sorted(uid for uid in uids if uid)
+
+    def counts(self, conn):
+        """{班级名称: 人数}，一次单层检索读出所有班级条目"""
+        if not conn.search(self.base, GROUP_FILTER, search_scope=LEVEL, attributes=['cn', 'member']):
+            return {}
+        counts = {}
+        for item in conn.response:
+            if item.get('type') != 'searchResEntry':
+                continue
+            names = _values(item['raw_attributes'], 'cn')
+            members = item['raw_attributes'].get('member', [])
+            if names and members:
+                counts[names[0]] = len(members)
+        return counts
+
+    def rebuild(self, conn, records, student_dn):
+        """按学生记录重建全部班级条目（首次启用或目录在应用外被修改后使用）
+
+        records 为 StudentRecord 迭代器，student_dn 为 uid -> DN 的函数；返回 {班级名称: 人数}。
+        全部写入成功后在 ou=classes 上写入重建完成的标记
+        """
+        wanted = {}
+        for record in records:
+            if is_real_class(record.class_name) and not record.role:
+                wanted.setdefault(record.class_name, []).append(student_dn(record.uid))
+
+        existing = {}
+        if not self.clear_built(conn):
+            raise RuntimeError(f'写入 ou=classes 失败: {conn.last_error}')
+        if conn.search(self.base, GROUP_FILTER, search_scope=LEVEL, attributes=['cn']):
+            for item in conn.response:
+                names = _values(item.get('raw_attributes', {}), 'cn')
+                if item.get('type') == 'searchResEntry' and names:
+                    existing[names[0]] = item['dn']
+        for class_name, dn in existing.items():
+            if class_name not in wanted:
+                conn.delete(dn)
+
+        for class_name, member_dns in wanted.items():
+            if class_name in existing:
+                ok = conn.modify(existing[class_name], {'member': [(MODIFY_REPLACE, member_dns)]})
+            else:
+                ok = conn.add(self.class_dn(class_name), ['groupOfNames'], {'cn': class_name, 'member': member_dns})
+            if not ok:
+                raise RuntimeError(f'写入班级条目失败 {class_name}: {conn.last_error}')
+        if not self.mark_built(conn):
+            raise RuntimeError(f'写入班级名册标记失败: {conn.last_error}')
+        return {name: len(member_dns) for name, member_dns in wanted.items()}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+密码哈希
+写入 userPassword 前生成带盐的 {SCHEME} 哈希，常数时间校验，
+识别旧的明文/base64 值以便迁移，批量导入时在进程池中并行做密钥拉伸
+"""
+
+import ast
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# SSHA 由 OpenLDAP 原生支持；SSHA256/512 需要 pw-sha2 模块，PBKDF2 需要 pw-pbkdf2 模块
+PASSWORD_SCHEME = os.getenv('PASSWORD_SCHEME', 'SSHA').upper()
+PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', '100000'))
+SALT_SIZE = 16
+
+_SALTED_DIGESTS = {'SSHA': 'sha1', 'SSHA256': 'sha256', 'SSHA512': 'sha512'}
+_PLAIN_DIGESTS = {'SHA': 'sha1', 'SHA256': 'sha256', 'SHA512': 'sha512'}
+_PBKDF2_DIGESTS = {'PBKDF2': 'sha1', 'PBKDF2-SHA1': 'sha1', 'PBKDF2-SHA256': 'sha256', 'PBKDF2-SHA512': 'sha512'}
+
+# 少于该数量的批量哈希直接在当前进程计算，进程池的启动和传输开销不值得
+PARALLEL_THRESHOLD = 64
+
+
+def _ab64_encode(data):
+    """pw-pbkdf2 使用的 adapted base64：'+' 换成 '.'，去掉填充"""
+    return base64.b64encode(data).decode('ascii').replace('+', '.').rstrip('=')
+
+
+def _ab64_decode(text):
+    text = text.replace('.', '+')
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def parse_scheme(stored):
+    """返回 {SCHEME} 前缀中的方案名，没有前缀时返回 None"""
+    if stored and stored.startswith('{'):
+        end = stored.find('}')
+        if end > 1:
+            return stored[1:end].upper()
+    return None
+
+
+def is_hashed(stored):
+    scheme = parse_scheme(stored)
+    return scheme is not None and scheme != 'CLEARTEXT'
+
+
+def hash_password(password, scheme=None, salt=None, iterations=None):
+    """生成 {SCHEME} 格式的密码哈希"""
+    scheme = (scheme or PASSWORD_SCHEME).upper()
+    secret = password.encode('utf-8')
+    salt = os.urandom(SALT_SIZE) if salt is None else salt
+
+    if scheme in _SALTED_DIGESTS:
+        digest = hashlib.new(_SALTED_DIGESTS[scheme], secret + salt).digest()
+        return f'{{{scheme}}}' + base64.b64encode(digest + salt).decode('ascii')
+
+    if scheme in _PBKDF2_DIGESTS:
+        iterations = iterations or PBKDF2_ITERATIONS
+        derived = hashlib.pbkdf2_hmac(_PBKDF2_DIGESTS[scheme], secret, salt, iterations)
+        return f'{{{scheme}}}{iterations}${_ab64_encode(salt)}${_ab64_encode(derived)}'
+
+    raise ValueError(f"不支持的密码哈希方案: {scheme}")
+
+
+def legacy_candidates(stored):
+    """未加前缀的旧值可能对应的明文：原值本身，以及按字节串字面量或 base64 解码得到的值（与旧登录逻辑的解析顺序一致）"""
+    decoded = None
+    if stored.startswith("b'") and stored.endswith("'"):
+        try:
+            decoded = ast.literal_eval(stored).decode('utf-8')
+        except (ValueError, SyntaxError, UnicodeDecodeError):
+            pass
+    else:
+        try:
+            decoded = base64.b64decode(stored, validate=True).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            pass
+    if decoded is None or decoded == stored:
+        return [stored]
+    return [stored, decoded]
+
+
+def legacy_plaintext(stored):
+    """还原旧数据中的明文密码，无法确定时返回 None
+
+    恰好是合法 base64 的明文（或形如 b'...' 的明文）与编码后的值无法区分，这类值只能在
+    用户登录时按实际输入的密码判断
+    """
+    if parse_scheme(stored) == 'CLEARTEXT':
+        return stored[len('{CLEARTEXT}'):]
+    candidates = legacy_candidates(stored)
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def verify_password(password, stored):
+    """常数时间比较密码与存储值，支持各哈希方案以及旧的明文/base64 值"""
+    if not password or not stored:
+        return False
+    secret = password.encode('utf-8')
+    scheme = parse_scheme(stored)
+
+    try:
+        if scheme in _SALTED_DIGESTS:
+            raw = base64.b64decode(stored[len(scheme) + 2:])
+            size = hashlib.new(_SALTED_DIGESTS[scheme]).digest_size
+            digest, salt = raw[:size], raw[size:]
+            return hmac.compare_digest(hashlib.new(_SALTED_DIGESTS[scheme], secret + salt).digest(), digest)
+
+        if scheme in _PLAIN_DIGESTS:
+            digest = base64.b64decode(stored[len(scheme) + 2:])
+            return hmac.compare_digest(hashlib.new(_PLAIN_DIGESTS[scheme], secret).digest(), digest)
+
+        if scheme in _PBKDF2_DIGESTS:
+            iterations, salt, derived = stored[len(scheme) + 2:].split('$')
+            actual = hashlib.pbkdf2_hmac(_PBKDF2_DIGESTS[scheme], secret, _ab64_decode(salt), int(iterations))
+            return hmac.compare_digest(actual, _ab64_decode(derived))
+    except (ValueError, TypeError):
+        return False
+
+    if scheme == 'CLEARTEXT':
+        return hmac.compare_digest(secret, stored[len('{CLEARTEXT}'):].encode('utf-8'))
+    if scheme is not None:
+        return False
+
+    # 未加前缀的旧数据：原值或解码后的值任一匹配即可
+    matches = [hmac.compare_digest(secret, candidate.encode('utf-8')) for candidate in legacy_candidates(stored)]
+    return any(matches)
+
+
+def needs_rehash(stored, scheme=None):
+    """存储值不是当前方案的哈希时返回 True（PBKDF2 迭代次数低于当前配置也算）"""
+    scheme = (scheme or PASSWORD_SCHEME).upper()
+    current = parse_scheme(stored)
+    if current != scheme:
+        return True
+    if scheme in _PBKDF2_DIGESTS:
+        try:
+            return int(stored[len(scheme) + 2:].split('$', 1)[0]) < PBKDF2_ITERATIONS
+        except ValueError:
+            return True
+    return False
+
+
+# ---- 批量哈希 ----
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers=None):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def _hash_chunk(passwords, scheme):
+    return [hash_password(password, scheme) for password in passwords]
+
+
+def hash_many(passwords, scheme=None, workers=None):
+    """批量生成哈希，每个密码使用独立的盐
+
+    PBKDF2 之类的慢哈希在数量较多时分块交给进程池，避免在请求线程上串行做密钥拉伸；
+    SSHA 每次只需一次摘要运算，直接在当前进程完成
+    """
+    scheme = (scheme or PASSWORD_SCHEME).upper()
+    passwords = list(passwords)
+    workers = workers or os.cpu_count() or 1
+    if scheme not in _PBKDF2_DIGESTS or len(passwords) < PARALLEL_THRESHOLD or workers < 2:
+        return [hash_password(password, scheme) for password in passwords]
+
+    executor = _get_executor(workers)
+    chunk_size = max(1, len(passwords) // (workers * 4))
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    hashes = []
+    for result in executor.map(_hash_chunk, chunks, [scheme] * len(chunks)):
+        hashes.extend(result)
+    return hashes
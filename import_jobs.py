@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台批量导入任务
+上传的文件交给线程池异步导入，立即返回任务ID，前端轮询任务进度
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class ImportJobManager:
+    """管理后台导入任务
+
+    - max_workers: 同时运行的导入任务数
+    - max_jobs: 最多保留的任务记录数，超出后丢弃最早完成的任务
+    """
+
+    def __init__(self, manager, max_workers=2, max_jobs=100):
+        self.manager = manager
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, path, filename):
+        """提交导入任务，返回任务ID；path 为已保存的临时文件，任务结束后删除"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'filename': filename,
+            'status': JOB_QUEUED,
+            'done': 0,
+            'total': 0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job_id, path, filename)
+        return job_id
+
+    def get(self, job_id):
+        """返回任务状态的副本，任务不存在时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        """丢弃多余的已结束任务（调用方需持有锁）"""
+        finished = [job for job in self._jobs.values() if job['status'] in (JOB_DONE, JOB_FAILED)]
+        finished.sort(key=lambda job: job['finished_at'])
+        while len(self._jobs) > self.max_jobs and finished:
+            del self._jobs[finished.pop(0)['id']]
+
+    def _run(self, job_id, path, filename):
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+
+        def progress(done, total):
+            self._update(job_id, done=done, total=total)
+
+        try:
+            if path.lower().endswith('.csv'):
+                report = self.manager.import_students_from_csv(path, progress=progress, stream=True)
+            else:
+                report = self.manager.import_students_from_excel(path, progress=progress, stream=True)
+
+            if report is False:
+                self._update(job_id, status=JOB_FAILED, error='文件读取或导入失败', finished_at=time.time())
+            else:
+                result = report.to_dict()
+                result['source'] = filename
+                self._update(job_id, status=JOB_DONE, result=result, finished_at=time.time())
+        except Exception as e:
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
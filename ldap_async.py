@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步LDAP访问
+在专用线程池中执行 StudentLDAPManager 的阻塞调用，对协程提供可 await 的接口：
+事件循环等待目录响应时不占用自身线程，一个进程可同时挂起多个目录操作，
+实际并发由执行线程数和两个连接池的大小决定
+
+async_ldap = AsyncStudentLDAPManager(manager)
+identities = await asyncio.gather(*(async_ldap.authenticate(uid, pw) for uid, pw in logins))
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from log_utils import get_logger, fields
+
+logger = get_logger('ldap_async')
+
+
+class AsyncStudentLDAPManager:
+    """StudentLDAPManager 的异步外观，与其共用连接池、身份缓存和学生索引
+
+    - max_workers: 执行阻塞调用的线程数，默认为管理员和认证两个连接池大小之和，
+      更多线程只会在连接池上排队
+    """
+
+    def __init__(self, manager, max_workers=None):
+        self.manager = manager
+        default_workers = manager.LDAP_POOL_SIZE + manager.LDAP_AUTH_POOL_SIZE
+        self.LDAP_ASYNC_WORKERS = max_workers or int(os.getenv('LDAP_ASYNC_WORKERS', str(default_workers)))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.LDAP_ASYNC_WORKERS,
+                                                        thread_name_prefix='ldap-async')
+                    logger.info('🔗 创建异步LDAP执行线程池', extra=fields(workers=self.LDAP_ASYNC_WORKERS))
+        return self._executor
+
+    async def _run(self, func, *args, **kwargs):
+        """在执行线程中调用 func，上下文变量（如指标的路由标签）随调用传递"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def authenticate(self, uid, password):
+        """以用户自己的DN绑定验证密码，成功返回 UserIdentity，失败返回 None"""
+        return await self._run(self.manager.authenticate, uid, password)
+
+    def _get_student_entry(self, uid):
+        with self.manager.connection():
+            return self.manager.get_student_entry(uid)
+
+    async def get_student_entry(self, uid):
+        """查询单个学生及其变更标记，返回 (StudentRecord, 变更标记, 修改时间)，不存在时返回 None"""
+        return await self._run(self._get_student_entry, uid)
+
+    def _page(self, page, per_page, cursor):
+        return self.manager.ensure_index().page(page, per_page, cursor=cursor)
+
+    async def page(self, page=1, per_page=8, cursor=None):
+        """从学生索引读取一页（索引未加载时先在执行线程中扫描目录）"""
+        return await self._run(self._page, page, per_page, cursor)
+
+    def close(self):
+        """停止执行线程池，已提交的调用执行完后返回"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
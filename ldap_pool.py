@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LDAP连接池
+复用已绑定的连接，避免每个请求重复建立TCP连接、绑定和读取Schema
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from ldap3 import Server, Connection, ALL, NONE, ANONYMOUS
+
+
+class PoolExhaustedError(ConnectionError):
+    """连接池在超时时间内没有可用连接"""
+
+
+class LDAPConnectionPool:
+    """线程安全的LDAP连接池
+
+    - size: 池中最多同时存在的连接数
+    - max_idle: 空闲超过该秒数的连接会被回收
+    - health_check_interval: 空闲超过该秒数的连接在借出前先做一次 WhoAmI 检查
+    - checkout_timeout: 池满时等待可用连接的最长秒数
+    - connection_class: 创建连接使用的类，可传入带指标记录的 Connection 子类
+    """
+
+    def __init__(self, server_url, user, password, size=8, max_idle=300,
+                 health_check_interval=30, checkout_timeout=10,
+                 get_info=ALL, client_strategy=None, server=None, connection_class=Connection):
+        self.user = user
+        self.password = password
+        self.size = size
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.client_strategy = client_strategy
+        self.connection_class = connection_class
+
+        # 所有连接共用同一个Server对象，Schema只在第一次绑定时读取
+        self.server = server or Server(server_url, get_info=get_info)
+
+        self._idle = deque()  # (conn, last_used)，右端为最近归还的连接
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'evicted': 0, 'waits': 0}
+
+    def _create_connection(self):
+        """新建并绑定一个连接"""
+        kwargs = {'user': self.user, 'password': self.password}
+        if self.client_strategy:
+            kwargs['client_strategy'] = self.client_strategy
+        conn = self.connection_class(self.server, **kwargs)
+        try:
+            bound = conn.bind()
+        except Exception as e:
+            raise ConnectionError(f"连接LDAP服务器失败: {e}") from e
+        if not bound:
+            error = conn.last_error
+            self._close(conn)
+            raise ConnectionError(f"LDAP绑定失败: {error}")
+        # Server信息已缓存在Server对象上，后续新建的连接不再重复读取
+        self.server.get_info = NONE
+        self._count('created')
+        return conn
+
+    def _count(self, key, n=1):
+        with self._cond:
+            self.stats[key] += n
+
+    def _is_healthy(self, conn, idle_for):
+        """检查借出的连接是否仍然可用"""
+        if conn.closed or not conn.bound:
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            return conn.extend.standard.who_am_i() is not None
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    def _evict_expired(self, now):
+        """回收空闲过久的连接（调用方需持有锁），返回待关闭的连接"""
+        expired = []
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            expired.append(self._idle.popleft()[0])
+        self.stats['evicted'] += len(expired)
+        return expired
+
+    def acquire(self, timeout=None):
+        """借出一个已绑定的连接"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                expired = self._evict_expired(time.monotonic())
+                while not self._idle and self._in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(f"{timeout}秒内没有可用的LDAP连接")
+                    self.stats['waits'] += 1
+                    self._cond.wait(remaining)
+                candidate = self._idle.pop() if self._idle else None
+                self._in_use += 1
+
+            for conn in expired:
+                self._close(conn)
+
+            if candidate is None:
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            conn, last_used = candidate
+            if self._is_healthy(conn, time.monotonic() - last_used):
+                self._count('reused')
+                return conn
+
+            # 连接已失效，丢弃后重新获取
+            self._close(conn)
+            self._count('discarded')
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def release(self, conn, discard=False):
+        """归还连接，discard=True 时直接关闭"""
+        if discard or conn.closed:
+            self._close(conn)
+            self._count('discarded')
+            self._release_slot()
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def restore(self, conn):
+        """把连接重新绑定为连接池自己的身份（配置的DN或匿名），成功返回 True
+
+        以其他身份绑定失败后连接处于未认证状态，恢复后即可归还复用，不必重新建立TCP连接
+        """
+        try:
+            if self.user:
+                return conn.rebind(user=self.user, password=self.password, read_server_info=False)
+            conn.user = None
+            conn.password = None
+            return conn.rebind(authentication=ANONYMOUS, read_server_info=False)
+        except Exception:
+            return False
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """以上下文管理器的方式借出连接，异常时丢弃该连接
+
+        GeneratorExit、KeyboardInterrupt 等 BaseException 同样会丢弃连接，
+        无论以何种方式离开 with 块都会归还占用的名额
+        """
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except BaseException:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def evict_idle(self):
+        """主动回收空闲过久的连接"""
+        with self._cond:
+            expired = self._evict_expired(time.monotonic())
+        for conn in expired:
+            self._close(conn)
+        return len(expired)
+
+    def close(self):
+        """关闭池中所有空闲连接"""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn)
+
+    def status(self):
+        """连接池当前状态"""
+        with self._cond:
+            return dict(self.stats, size=self.size, idle=len(self._idle), in_use=self._in_use)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结构化日志
+日志记录先放入内存队列，由后台线程写到 stdout，请求线程不再阻塞在输出上；
+支持日志级别、JSON/文本格式、高频事件采样和凭据字段脱敏
+
+logger = get_logger('app')
+logger.info('学生添加成功', extra=fields(uid=uid))
+logger.debug('查询学生列表', extra=fields(page=page, sample=True))   # 高频事件按 LOG_SAMPLE_EVERY 采样
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()  # json | text
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '100'))
+
+ROOT_LOGGER = 'student_ldap'
+REDACTED = '***'
+
+# 字段名（不区分大小写）包含这些词时值会被替换
+SENSITIVE_WORDS = ('password', 'passwd', 'secret', 'token', 'captcha', 'credential')
+# 消息文本中形如 password=xxx / userPassword: xxx 的片段
+_SENSITIVE_TEXT = re.compile(r'((?:user)?password|passwd|secret|token)(\s*[=:]\s*)(\S+)', re.IGNORECASE)
+
+# LogRecord 自带的属性，不作为结构化字段输出
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_logger(name):
+    """返回本系统的子日志器"""
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def fields(sample=False, **values):
+    """构造 extra 参数：values 作为结构化字段输出，sample=True 表示该记录参与采样"""
+    return {'fields': values, 'sample': sample}
+
+
+def _is_sensitive(key):
+    key = str(key).lower()
+    return any(word in key for word in SENSITIVE_WORDS)
+
+
+def redact(value):
+    """递归替换字典中的凭据字段"""
+    if isinstance(value, dict):
+        return {key: REDACTED if _is_sensitive(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_text(text):
+    return _SENSITIVE_TEXT.sub(lambda m: m.group(1) + m.group(2) + REDACTED, text)
+
+
+class SamplingFilter(logging.Filter):
+    """带 sample=True 的高频记录，同一日志器的同一条消息模板每 every 条只保留 1 条"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False) or self.every == 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+
+class RedactingFilter(logging.Filter):
+    """在记录进入队列前脱敏，凭据不会出现在任何输出中"""
+
+    def filter(self, record):
+        values = getattr(record, 'fields', None)
+        if values:
+            record.fields = redact(values)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        record.msg = redact_text(str(record.msg))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in ('fields', 'sample', 'sample_every') and key not in data:
+                data[key] = value
+        if getattr(record, 'sample_every', None):
+            data['sample_every'] = record.sample_every
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于终端阅读的单行文本，结构化字段以 key=value 附在末尾"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s', '%H:%M:%S')
+
+    def format(self, record):
+        text = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in values.items())
+        return text
+
+
+class _PreformattedQueueHandler(QueueHandler):
+    """入队时只固定消息文本和异常文本，结构化字段原样交给后台线程格式化"""
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None, fmt=None, stream=None, sample_every=None):
+    """配置本系统的日志输出（重复调用无副作用），返回根日志器"""
+    global _listener
+    logger = logging.getLogger(ROOT_LOGGER)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(TextFormatter() if (fmt or LOG_FORMAT) == 'text' else JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _PreformattedQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_EVERY if sample_every is None else sample_every))
+        queue_handler.addFilter(RedactingFilter())
+
+        logger.setLevel(level or LOG_LEVEL)
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+
+        _listener = QueueListener(log_queue, handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+记录每个路由和每类LDAP操作的次数、错误数、延迟直方图和返回条目数，
+LDAP指标按发起操作的路由分组，以 Prometheus 文本格式输出
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from ldap3 import Connection
+from log_utils import get_logger
+
+logger = get_logger('metrics')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ENTRY_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+# 不计为错误的LDAP结果码：success、noSuchObject（查询不存在的条目）、compareFalse/compareTrue
+LDAP_OK_RESULTS = {0, 5, 6, 32}
+
+BACKGROUND = 'background'
+
+
+class Histogram:
+    """累积桶直方图"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._help = {}
+        self._collectors = []
+        # 上下文变量：同步请求按线程隔离，异步视图交给执行线程的调用也能取到发起请求的路由
+        self._endpoint = ContextVar('metrics_endpoint', default=None)
+
+    # ---- 当前路由 ----
+
+    @property
+    def endpoint(self):
+        """当前线程正在处理的路由，后台线程返回 background"""
+        return self._endpoint.get() or BACKGROUND
+
+    @endpoint.setter
+    def endpoint(self, value):
+        self._endpoint.set(value)
+
+    # ---- 记录 ----
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, collector):
+        """注册在输出时调用的采集函数，返回 [(名称, 类型, 说明, [(标签, 值), ...]), ...]"""
+        self._collectors.append(collector)
+
+    def observe_request(self, endpoint, method, status, seconds):
+        labels = (('endpoint', endpoint), ('method', method))
+        self.inc('http_requests_total', labels + (('status', status),))
+        self.observe('http_request_duration_seconds', seconds, labels)
+
+    def observe_ldap(self, operation, seconds, error=False, entries=None):
+        labels = (('operation', operation), ('endpoint', self.endpoint))
+        self.inc('ldap_operations_total', labels)
+        if error:
+            self.inc('ldap_operation_errors_total', labels)
+        self.observe('ldap_operation_duration_seconds', seconds, labels)
+        if entries is not None:
+            self.observe('ldap_search_entries', entries, (('endpoint', self.endpoint),), ENTRY_BUCKETS)
+
+    # ---- 输出 ----
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, (list(h.buckets), list(h.counts), h.sum, h.count)) for key, h in self._histograms.items()),
+                key=lambda item: item[0])
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                text = self._help.get(name, (kind, name))[1]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception:
+                logger.exception('❌ 指标采集失败')
+                continue
+            for name, kind, text, values in samples:
+                self._help.setdefault(name, (kind, text))
+                header(name, kind)
+                for labels, value in values:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.describe('http_requests_total', 'counter', '按路由、方法和状态码统计的请求数')
+registry.describe('http_request_duration_seconds', 'histogram', '请求处理耗时（秒）')
+registry.describe('ldap_operations_total', 'counter', '按操作类型和发起路由统计的LDAP操作数')
+registry.describe('ldap_operation_errors_total', 'counter', '失败的LDAP操作数')
+registry.describe('ldap_operation_duration_seconds', 'histogram', 'LDAP操作耗时（秒）')
+registry.describe('ldap_search_entries', 'histogram', '每次LDAP查询返回的条目数')
+
+
+class InstrumentedConnection(Connection):
+    """记录每次 bind/search/add/modify/delete 等操作耗时和结果的 ldap3 连接"""
+
+    def _record(self, operation, call, entries_of_result=False):
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            registry.observe_ldap(operation, time.perf_counter() - started, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        code = (self.result or {}).get('result', 0) if isinstance(self.result, dict) else 0
+        entries = None
+        if entries_of_result:
+            entries = sum(1 for item in (self.response or ()) if item.get('type') == 'searchResEntry')
+        registry.observe_ldap(operation, elapsed, error=code not in LDAP_OK_RESULTS, entries=entries)
+        return result
+
+    def bind(self, *args, **kwargs):
+        return self._record('bind', lambda: super(InstrumentedConnection, self).bind(*args, **kwargs))
+
+    def search(self, *args, **kwargs):
+        return self._record('search', lambda: super(InstrumentedConnection, self).search(*args, **kwargs), True)
+
+    def add(self, *args, **kwargs):
+        return self._record('add', lambda: super(InstrumentedConnection, self).add(*args, **kwargs))
+
+    def modify(self, *args, **kwargs):
+        return self._record('modify', lambda: super(InstrumentedConnection, self).modify(*args, **kwargs))
+
+    def delete(self, *args, **kwargs):
+        return self._record('delete', lambda: super(InstrumentedConnection, self).delete(*args, **kwargs))
+
+    def modify_dn(self, *args, **kwargs):
+        return self._record('modify_dn', lambda: super(InstrumentedConnection, self).modify_dn(*args, **kwargs))
+
+    def extended(self, *args, **kwargs):
+        return self._record('extended', lambda: super(InstrumentedConnection, self).extended(*args, **kwargs))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源指纹
+构建时把自定义CSS/JS按内容哈希复制到 static/dist/，并生成 .gz / .br 预压缩文件供 nginx 直接发送；
+模板通过 asset_url() 引用，内容不变时URL不变，浏览器可长期缓存
+
+# 部署时构建
+python static_assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+from log_utils import get_logger, fields, setup_logging
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只生成 .gz
+    brotli = None
+
+logger = get_logger('assets')
+
+# 需要加指纹的资源（相对 static 目录）
+ASSETS = ('css/style.css', 'js/main.js')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 10
+# 带指纹的文件名永不变化，可以按一年缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(filename, digest):
+    """css/style.css -> css/style.<哈希>.css"""
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{digest}{ext}'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _outputs(static_folder, manifest):
+    """清单中各指纹文件及其预压缩版本的路径"""
+    paths = set()
+    for target in manifest.values():
+        path = os.path.join(static_folder, target)
+        paths.update((path, f'{path}.gz', f'{path}.br'))
+    return paths
+
+
+def build_assets(static_folder, assets=ASSETS):
+    """生成带指纹的资源及其预压缩版本，写入清单并清理旧版本，返回 {原文件名: 指纹文件名}
+
+    上一次构建的文件保留到下一次构建：构建前渲染的页面仍引用旧指纹，不能立即删除
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest_path = os.path.join(dist, MANIFEST_NAME)
+    previous = _load_manifest(manifest_path)
+    manifest = {}
+    outputs = {manifest_path} | _outputs(static_folder, previous)
+    for filename in assets:
+        with open(os.path.join(static_folder, filename), 'rb') as source:
+            data = source.read()
+        target = f'{DIST_DIR}/{fingerprinted_name(filename, content_hash(data))}'
+        path = os.path.join(static_folder, target)
+        _write(path, data)
+        # mtime=0 使相同内容每次构建得到相同的 .gz
+        _write(f'{path}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        outputs.update((path, f'{path}.gz'))
+        if brotli is not None:
+            _write(f'{path}.br', brotli.compress(data, quality=11))
+            outputs.add(f'{path}.br')
+        manifest[filename] = target
+        logger.info('📦 生成静态资源', extra=fields(source=filename, target=target, bytes=len(data)))
+
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    # 删除更早的构建留下的旧指纹文件
+    for directory, _, names in os.walk(dist):
+        for name in names:
+            path = os.path.join(directory, name)
+            if path not in outputs:
+                os.remove(path)
+    if brotli is None:
+        logger.warning('⚠️ 未安装 brotli，只生成 .gz 预压缩文件')
+    return manifest
+
+
+class AssetManifest:
+    """把资源文件名解析为带指纹的URL路径
+
+    有构建清单时返回 dist/ 下的指纹文件；没有构建（开发环境）时返回原文件并附加内容哈希参数，
+    哈希按文件修改时间缓存。清单按修改时间重新加载，运行中重新构建无需重启
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._manifest = {}
+        self._mtime = None
+        self._hashes = {}
+
+    @property
+    def manifest(self):
+        path = os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._manifest = _load_manifest(path) if mtime is not None else {}
+            self._mtime = mtime
+        return self._manifest
+
+    def reload(self):
+        self._mtime = None
+        self._manifest = {}
+        self._hashes.clear()
+
+    def resolve(self, filename):
+        """返回 (static 下的文件名, 查询参数)，查询参数为 None 表示文件名已带指纹"""
+        target = self.manifest.get(filename)
+        if target:
+            return target, None
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return filename, None
+        cached = self._hashes.get(filename)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as source:
+                cached = (mtime, content_hash(source.read()))
+            self._hashes[filename] = cached
+        return filename, cached[1]
+
+    def send_file_max_age(self, filename):
+        """Flask 发送静态文件时的缓存时间：指纹文件一年，其余使用默认值"""
+        if filename and filename.replace(os.sep, '/').startswith(f'{DIST_DIR}/'):
+            return IMMUTABLE_MAX_AGE
+        return None
+
+
+if __name__ == '__main__':
+    setup_logging(fmt='text')
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    build_assets(folder)
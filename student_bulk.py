@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量管理操作
+一次请求修改或删除一组学生：按批借出连接池中的连接，多个批次并行执行，
+每个学生返回独立的结果，单个失败不影响其余学生
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ldap3 import MODIFY_REPLACE
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT
+from credentials import hash_password
+from student_import import EMAIL_PATTERN
+from student_record import CLASS_PREFIX
+
+EDITABLE_FIELDS = ('cn', 'sn', 'mail', 'class_name', 'password')
+
+# 单项状态
+STATUS_UPDATED = 'updated'
+STATUS_DELETED = 'deleted'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_INVALID = 'invalid'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def run_in_batches(items, handler, workers=4, batch_size=100):
+    """把 items 切成批次交给 handler(batch)，批次数大于1时用线程池并行"""
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    if len(batches) <= 1 or workers <= 1:
+        for batch in batches:
+            handler(batch)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(handler, batch) for batch in batches]:
+            future.result()
+
+
+def validate_changes(changes):
+    """校验单个学生的修改内容，返回错误原因，没有问题时返回 None"""
+    unknown = [name for name in changes if name not in EDITABLE_FIELDS]
+    if unknown:
+        return f"不支持修改的字段: {', '.join(unknown)}"
+    if not changes:
+        return '没有要修改的字段'
+    for name in ('cn', 'sn', 'mail'):
+        if name in changes and not changes[name]:
+            return '姓名、姓氏和邮箱不能为空'
+    if 'mail' in changes and not re.match(EMAIL_PATTERN, changes['mail']):
+        return '邮箱格式不正确'
+    return None
+
+
+def modify_request(changes):
+    """把修改内容转换为 LDAP 修改请求，以及更新索引用的新值"""
+    request = {}
+    values = {}
+    for name, value in changes.items():
+        if name == 'class_name':
+            description = f'{CLASS_PREFIX}{value}' if value else ''
+            request['description'] = [(MODIFY_REPLACE, [description] if description else [])]
+            values['description'] = description
+        elif name == 'password':
+            request['userPassword'] = [(MODIFY_REPLACE, [hash_password(value)])]
+        else:
+            request[name] = [(MODIFY_REPLACE, [value])]
+            values[name] = value
+    return request, values
+
+
+class BatchResult:
+    """批量操作的逐项结果"""
+
+    def __init__(self, action):
+        self.action = action
+        self.rows = []
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, uid, status, message=''):
+        with self._lock:
+            self.rows.append({'uid': uid, 'status': status, 'message': message})
+
+    def count(self, status):
+        return sum(1 for row in self.rows if row['status'] == status)
+
+    @property
+    def success_count(self):
+        return self.count(STATUS_UPDATED) + self.count(STATUS_DELETED)
+
+    def to_dict(self):
+        counts = {}
+        for row in self.rows:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+        return {
+            'action': self.action,
+            'total': len(self.rows),
+            'succeeded': self.success_count,
+            'counts': counts,
+            'elapsed': round(self.elapsed, 3),
+            'results': sorted(self.rows, key=lambda row: row['uid'])
+        }
+
+
+class BulkEditor:
+    """在连接池上执行批量修改和删除
+
+    - workers: 并行的批次数，每个批次借出一个连接
+    - batch_size: 每个批次在同一连接上连续处理的学生数
+    """
+
+    def __init__(self, manager, workers=4, batch_size=100):
+        self.manager = manager
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+    def _failure(self, conn):
+        if conn.result.get('result') == RESULT_NO_SUCH_OBJECT:
+            return STATUS_NOT_FOUND, '学生不存在'
+        return STATUS_FAILED, str(conn.last_error)
+
+    def _update_batch(self, batch, result):
+        manager = self.manager
+        with manager.pool.connection() as conn:
+            for uid, changes, previous in batch:
+                try:
+                    request, values = modify_request(changes)
+                    if conn.modify(manager.student_dn(uid), request):
+                        manager.identity_cache.invalidate(uid)
+                        manager.update_index(uid, values)
+                        if 'class_name' in changes:
+                            manager.update_class_roster(conn, uid, changes['class_name'] or None, previous=previous)
+                        result.add(uid, STATUS_UPDATED)
+                    else:
+                        result.add(uid, *self._failure(conn))
+                except Exception as e:
+                    result.add(uid, STATUS_FAILED, str(e))
+
+    def _delete_batch(self, batch, result):
+        manager = self.manager
+        with manager.pool.connection() as conn:
+            for uid, previous in batch:
+                try:
+                    if conn.delete(manager.student_dn(uid)):
+                        manager.identity_cache.invalidate(uid)
+                        manager.student_index.remove(uid)
+                        manager.update_class_roster(conn, uid, None, previous=previous)
+                        result.add(uid, STATUS_DELETED)
+                    else:
+                        result.add(uid, *self._failure(conn))
+                except Exception as e:
+                    result.add(uid, STATUS_FAILED, str(e))
+
+    def update(self, items, result=None):
+        """items 为 (uid, 修改内容, 已知的原班级或 None) 列表，返回 BatchResult"""
+        started = time.perf_counter()
+        result = result or BatchResult('update')
+        pending = []
+        for uid, changes, previous in items:
+            reason = validate_changes(changes)
+            if reason:
+                result.add(uid, STATUS_INVALID, reason)
+            else:
+                pending.append((uid, changes, previous))
+        run_in_batches(pending, lambda batch: self._update_batch(batch, result), self.workers, self.batch_size)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def delete(self, items, result=None):
+        """items 为 (uid, 已知的原班级或 None) 列表，返回 BatchResult"""
+        started = time.perf_counter()
+        result = result or BatchResult('delete')
+        run_in_batches(items, lambda batch: self._delete_batch(batch, result), self.workers, self.batch_size)
+        if result.count(STATUS_DELETED):
+            self.manager.invalidate_listing()
+        result.elapsed = time.perf_counter() - started
+        return result
@@ -12,14 +12,53 @@ uid,cn,sn,mail,password,class_name
 student001,张三,张,student001@szuldpa-edu.com,123456,计算机2021-1班
 """
 
-import csv
+import json
 import pandas as pd
 import getpass
-import hashlib
-from ldap3 import Server, Connection, ALL, MODIFY_REPLACE, SUBTREE
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from ldap3 import MODIFY_REPLACE, SUBTREE, BASE
+from ldap3.utils.dn import escape_rdn
+from ldap_pool import LDAPConnectionPool
+from metrics import InstrumentedConnection
+from student_paging import StudentPager, uid_filter, decode_cursor, paged_search, page_result, empty_page
+from student_index import StudentIndex, INDEX_ATTRIBUTES
+from student_record import StudentRecord, UNASSIGNED_CLASS, parse_class_name, resolve_columns
+from class_roster import ClassRosters, is_real_class
+from ttl_cache import TTLCache
+from user_identity import UserIdentity, load_identity
+from credentials import hash_password, hash_many, is_hashed, legacy_plaintext, needs_rehash, verify_password
+from log_utils import get_logger, fields, setup_logging
+from student_import import BulkImporter, STATUS_ADDED, iter_csv_chunks, iter_xlsx_chunks
+from student_export import EXPORT_FORMATS, iter_records, iter_csv, iter_xlsx
+from student_bulk import BulkEditor, BatchResult, STATUS_INVALID, STATUS_SKIPPED
+from student_reconcile import Reconciler, ReconcileReport, directory_snapshot, plan_reconcile
 import os
 import sys
 
+logger = get_logger('ldap')
+
+# 条目的变更标记（操作属性），用于生成 HTTP 验证器
+ENTRY_VERSION_ATTRIBUTES = ('entryCSN', 'modifyTimestamp')
+
+
+def _first_value(values):
+    if not values:
+        return None
+    value = values[0]
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+def parse_generalized_time(value):
+    """解析LDAP的 GeneralizedTime（如 20240901083000Z），无法解析时返回 None"""
+    if not value or len(value) < 14:
+        return None
+    try:
+        return datetime.strptime(value[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
 class StudentLDAPManager:
     def __init__(self):
         # LDAP 配置信息
@@ -27,47 +66,300 @@ class StudentLDAPManager:
         self.LDAP_BASE_DN = 'dc=szuldpa-edu,dc=com'
         self.LDAP_ADMIN_DN = 'cn=admin,dc=szuldpa-edu,dc=com'
         self.LDAP_ADMIN_PASSWORD = None
-        self.conn = None
-        
+
+        # 连接池配置
+        self.LDAP_POOL_SIZE = int(os.getenv('LDAP_POOL_SIZE', '8'))
+        self.LDAP_POOL_MAX_IDLE = int(os.getenv('LDAP_POOL_MAX_IDLE', '300'))
+        self.LDAP_POOL_HEALTH_CHECK = int(os.getenv('LDAP_POOL_HEALTH_CHECK', '30'))
+        self.LDAP_POOL_TIMEOUT = int(os.getenv('LDAP_POOL_TIMEOUT', '10'))
+        # 登录认证专用连接池的大小（以用户身份绑定，与管理员连接分开）
+        self.LDAP_AUTH_POOL_SIZE = int(os.getenv('LDAP_AUTH_POOL_SIZE', '4'))
+
+        # 学生列表键缓存（排序后的uid和总数）的有效期
+        self.LDAP_LIST_CACHE_TTL = int(os.getenv('LDAP_LIST_CACHE_TTL', '60'))
+        self._pager = StudentPager(ttl=self.LDAP_LIST_CACHE_TTL)
+
+        # 进程内的用户身份缓存（角色和个人信息），写操作时同步失效
+        self.LDAP_IDENTITY_CACHE_SIZE = int(os.getenv('LDAP_IDENTITY_CACHE_SIZE', '1024'))
+        self.LDAP_IDENTITY_CACHE_TTL = int(os.getenv('LDAP_IDENTITY_CACHE_TTL', '60'))
+        self.identity_cache = TTLCache(maxsize=self.LDAP_IDENTITY_CACHE_SIZE,
+                                       ttl=self.LDAP_IDENTITY_CACHE_TTL)
+
+        # 绑定失败时是否检查旧格式（明文/base64）密码；migrate-passwords 完成后设为 0
+        self.LDAP_LEGACY_PASSWORDS = os.getenv('LDAP_LEGACY_PASSWORDS', '1') == '1'
+        # 已确认没有旧格式密码的uid（不存在或已是哈希），有效期内绑定失败不再用管理员连接检查
+        self.LDAP_LEGACY_CACHE_TTL = int(os.getenv('LDAP_LEGACY_CACHE_TTL', '300'))
+        self._legacy_misses = TTLCache(maxsize=self.LDAP_IDENTITY_CACHE_SIZE, ttl=self.LDAP_LEGACY_CACHE_TTL)
+
+        # 进程内学生目录索引，写操作增量更新，超过该秒数后全量重新同步
+        self.LDAP_INDEX_RESYNC = int(os.getenv('LDAP_INDEX_RESYNC', '300'))
+        # 增量同步轮询间隔，秒；0 表示不启用
+        self.LDAP_SYNC_INTERVAL = int(os.getenv('LDAP_SYNC_INTERVAL', '5'))
+        self.student_index = StudentIndex()
+        self._index_lock = threading.Lock()
+
+        # 在 ou=classes 下维护每个班级的 groupOfNames 条目，增删改学生时同步成员
+        self.LDAP_CLASS_ROSTERS = os.getenv('LDAP_CLASS_ROSTERS', '1') == '1'
+        self.class_rosters = ClassRosters(self.LDAP_BASE_DN)
+        self._rosters_ready = False
+        self._rosters_lock = threading.Lock()
+
+        # 批量修改/删除单次请求允许的最大学生数，以及并行的批次数
+        self.LDAP_BATCH_MAX_ITEMS = int(os.getenv('LDAP_BATCH_MAX_ITEMS', '5000'))
+        self.LDAP_BATCH_WORKERS = int(os.getenv('LDAP_BATCH_WORKERS', '4'))
+
+        self._pool = None
+        self._auth_pool = None
+        self._pool_lock = threading.Lock()
+        # 每个线程持有各自借出的连接，避免并发请求争用同一个连接
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        """当前线程借出的连接"""
+        return getattr(self._local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self._local.conn = value
+
+    def _load_admin_password(self):
+        """获取管理员密码：环境变量 > 配置文件 > 交互输入"""
+        if self.LDAP_ADMIN_PASSWORD:
+            return self.LDAP_ADMIN_PASSWORD
+
+        # 优先从环境变量获取
+        self.LDAP_ADMIN_PASSWORD = os.getenv('LDAP_ADMIN_PASSWORD')
+
+        # 如果环境变量也没有，尝试从配置文件读取
+        if not self.LDAP_ADMIN_PASSWORD:
+            try:
+                with open('.ldap_password', 'r') as f:
+                    self.LDAP_ADMIN_PASSWORD = f.read().strip()
+            except FileNotFoundError:
+                pass
+
+        # 如果都没有，提示用户输入
+        if not self.LDAP_ADMIN_PASSWORD:
+            self.LDAP_ADMIN_PASSWORD = getpass.getpass("请输入LDAP管理员密码: ")
+        return self.LDAP_ADMIN_PASSWORD
+
+    @property
+    def pool(self):
+        """延迟创建的连接池"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = LDAPConnectionPool(
+                        self.LDAP_SERVER,
+                        self.LDAP_ADMIN_DN,
+                        self._load_admin_password(),
+                        size=self.LDAP_POOL_SIZE,
+                        max_idle=self.LDAP_POOL_MAX_IDLE,
+                        health_check_interval=self.LDAP_POOL_HEALTH_CHECK,
+                        checkout_timeout=self.LDAP_POOL_TIMEOUT,
+                        connection_class=InstrumentedConnection,
+                    )
+        return self._pool
+
+    @property
+    def auth_pool(self):
+        """延迟创建的登录认证连接池
+
+        连接先匿名绑定，每次登录时以用户自己的DN重新绑定，绝不归还到管理员连接池
+        """
+        if self._auth_pool is None:
+            admin_pool = self.pool
+            with self._pool_lock:
+                if self._auth_pool is None:
+                    self._auth_pool = LDAPConnectionPool(
+                        self.LDAP_SERVER, None, None,
+                        size=self.LDAP_AUTH_POOL_SIZE,
+                        max_idle=self.LDAP_POOL_MAX_IDLE,
+                        health_check_interval=self.LDAP_POOL_HEALTH_CHECK,
+                        checkout_timeout=self.LDAP_POOL_TIMEOUT,
+                        client_strategy=admin_pool.client_strategy,
+                        server=admin_pool.server,
+                        connection_class=admin_pool.connection_class,
+                    )
+        return self._auth_pool
+
+    def pool_status(self):
+        """已创建的连接池的状态，{'admin': {...}, 'auth': {...}}"""
+        pools = {'admin': self._pool, 'auth': self._auth_pool}
+        return {name: pool.status() for name, pool in pools.items() if pool is not None}
+
+    def authenticate(self, uid, password):
+        """以用户自己的DN做一次简单绑定来验证密码
+
+        成功返回 UserIdentity，失败返回 None；身份优先取缓存，否则在同一个已绑定的会话中读取自己的条目。
+        身份缓存命中时仍读取密码检查其哈希方案，明文或过时哈希在登录成功后经管理员连接升级
+        """
+        if not uid or not password:
+            # 空密码的简单绑定会被服务器当作匿名绑定而成功
+            return None
+
+        dn = self.student_dn(uid)
+        identity = self.identity_cache.get(uid)
+        pool = self.auth_pool
+        conn = pool.acquire()
+        bound = False
+        raw_attributes = None
+        try:
+            bound = conn.rebind(user=dn, password=password, read_server_info=False)
+            if bound:
+                attributes = ['userPassword'] if identity is not None else UserIdentity.ATTRIBUTES + ['userPassword']
+                conn.search(dn, '(objectClass=inetOrgPerson)', search_scope=BASE, attributes=attributes)
+                if conn.response:
+                    raw_attributes = conn.response[0]['raw_attributes']
+                    if identity is None:
+                        identity = UserIdentity.from_raw(raw_attributes)
+        finally:
+            # 绑定失败后连接处于未认证状态，恢复为匿名绑定后归还，下一次登录不必重新建立连接
+            pool.release(conn, discard=not bound and not pool.restore(conn))
+
+        if not bound:
+            return self._authenticate_legacy(uid, dn, password) if self.LDAP_LEGACY_PASSWORDS else None
+        if raw_attributes is not None:
+            self._upgrade_password(dn, raw_attributes, password)
+        if identity is None:
+            # 服务器ACL不允许用户读取自己的条目时，改用管理员连接读取
+            return load_identity(self, uid)
+        self.identity_cache.set(uid, identity)
+        return identity
+
+    def _authenticate_legacy(self, uid, dn, password):
+        """绑定失败时检查旧格式的密码
+
+        服务器只按原值比较未加前缀的 userPassword，base64 等旧格式保存的密码无法通过绑定；
+        用管理员连接读出存储值校验，通过后立即改写为当前方案的哈希。
+        不存在或密码已是哈希的uid记入 _legacy_misses，有效期内再次失败时不再检索
+        """
+        if self._legacy_misses.get(uid):
+            return None
+        with self.pool.connection() as conn:
+            conn.search(dn, '(objectClass=inetOrgPerson)', search_scope=BASE,
+                        attributes=UserIdentity.ATTRIBUTES + ['userPassword'])
+            raw_attributes = conn.response[0]['raw_attributes'] if conn.response else {}
+        values = raw_attributes.get('userPassword')
+        stored = values[0].decode('utf-8', 'replace') if values else ''
+        if not stored or is_hashed(stored):
+            self._legacy_misses.set(uid, True)
+            return None
+        if not verify_password(password, stored):
+            return None
+        self._upgrade_password(dn, raw_attributes, password)
+
+        logger.info('🔐 旧格式密码登录并已升级', extra=fields(uid=uid))
+        identity = UserIdentity.from_raw(raw_attributes)
+        self.identity_cache.set(uid, identity)
+        return identity
+
+    def _upgrade_password(self, dn, raw_attributes, password):
+        """登录成功后把旧的明文或过时哈希替换为当前方案的哈希
+
+        经管理员连接池写入，不依赖服务器是否允许用户改写自己的 userPassword
+        """
+        values = raw_attributes.get('userPassword')
+        if not values:
+            return
+        if needs_rehash(values[0].decode('utf-8', 'replace')):
+            try:
+                with self.pool.connection() as conn:
+                    if not conn.modify(dn, {'userPassword': [(MODIFY_REPLACE, [hash_password(password)])]}):
+                        logger.warning('密码哈希升级失败: %s', conn.last_error, extra=fields(dn=dn))
+            except Exception as e:
+                logger.warning('密码哈希升级失败: %s', e, extra=fields(dn=dn))
+
+    def migrate_passwords(self, dry_run=False):
+        """把目录中所有明文/base64 密码迁移为当前方案的哈希，返回各类数量
+
+        已是其他方案哈希的密码无法还原明文，保留原值，等用户下次登录时再升级；
+        无法确定是明文还是 base64 编码的值（ambiguous）同样留给登录时处理
+        """
+        search_base = f'ou=students,{self.LDAP_BASE_DN}'
+        pending = []
+        counts = {'migrated': 0, 'current': 0, 'skipped': 0, 'ambiguous': 0, 'failed': 0}
+        try:
+            with self.connection() as conn:
+                for page in paged_search(conn, search_base, '(objectClass=inetOrgPerson)', ['userPassword'], page_size=1000):
+                    for item in page:
+                        values = item['raw_attributes'].get('userPassword')
+                        if not values:
+                            continue
+                        stored = values[0].decode('utf-8', 'replace')
+                        if not needs_rehash(stored):
+                            counts['current'] += 1
+                        elif is_hashed(stored):
+                            counts['skipped'] += 1
+                        else:
+                            plaintext = legacy_plaintext(stored)
+                            if plaintext is None:
+                                # 原值既可能是明文也可能是编码后的值，留给用户登录时按实际输入升级
+                                counts['ambiguous'] += 1
+                            else:
+                                pending.append((item['dn'], plaintext))
+
+                if dry_run:
+                    counts['migrated'] = len(pending)
+                    return counts
+
+                hashes = hash_many(plaintext for _, plaintext in pending)
+                for (dn, _), password_hash in zip(pending, hashes):
+                    if conn.modify(dn, {'userPassword': [(MODIFY_REPLACE, [password_hash])]}):
+                        counts['migrated'] += 1
+                    else:
+                        counts['failed'] += 1
+            logger.info('🔐 密码迁移完成', extra=fields(**counts))
+            return counts
+        except Exception:
+            logger.exception('❌ 密码迁移失败')
+            return False
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接并绑定到当前线程，可嵌套使用
+
+        with manager.connection() as conn:
+            manager.add_student(...)
+        """
+        if self.conn is not None:
+            # 已持有连接（嵌套调用或之前的connect()），直接复用
+            yield self.conn
+            return
+
+        with self.pool.connection() as conn:
+            self.conn = conn
+            try:
+                yield conn
+            finally:
+                self.conn = None
+
     def connect(self):
-        """连接到LDAP服务器"""
+        """从连接池借出连接（与 disconnect() 配对使用）"""
+        if self.conn is not None:
+            return True
         try:
-            # 如果没有设置密码，从环境变量或配置文件获取
-            if not self.LDAP_ADMIN_PASSWORD:
-                import os
-                # 优先从环境变量获取
-                self.LDAP_ADMIN_PASSWORD = os.getenv('LDAP_ADMIN_PASSWORD')
-                
-                # 如果环境变量也没有，尝试从配置文件读取
-                if not self.LDAP_ADMIN_PASSWORD:
-                    try:
-                        with open('.ldap_password', 'r') as f:
-                            self.LDAP_ADMIN_PASSWORD = f.read().strip()
-                    except FileNotFoundError:
-                        pass
-                
-                # 如果都没有，提示用户输入
-                if not self.LDAP_ADMIN_PASSWORD:
-                    self.LDAP_ADMIN_PASSWORD = getpass.getpass("请输入LDAP管理员密码: ")
-            
-            server = Server(self.LDAP_SERVER, get_info=ALL)
-            self.conn = Connection(server, user=self.LDAP_ADMIN_DN, password=self.LDAP_ADMIN_PASSWORD)
-            
-            if not self.conn.bind():
-                print("❌ 连接LDAP服务器失败:", self.conn.last_error)
-                return False
-            else:
-                print("✅ 成功连接到LDAP服务器")
-                return True
+            self.conn = self.pool.acquire()
+            return True
         except Exception as e:
-            print(f"❌ 连接错误: {e}")
+            logger.error('❌ 连接错误: %s', e)
             return False
     
     def disconnect(self):
-        """断开LDAP连接"""
-        if self.conn:
-            self.conn.unbind()
-            print("🔌 已断开LDAP连接")
+        """归还LDAP连接"""
+        conn = self.conn
+        if conn:
+            self.conn = None
+            self.pool.release(conn)
+
+    def close_pool(self):
+        """关闭连接池中的所有连接"""
+        if self._auth_pool is not None:
+            self._auth_pool.close()
+        if self._pool is not None:
+            self._pool.close()
+            logger.info('🔌 已断开LDAP连接')
 
     def create_ou_structure(self):
         """创建组织单位结构"""
@@ -76,263 +368,590 @@ class StudentLDAPManager:
             students_ou = f'ou=students,{self.LDAP_BASE_DN}'
             if not self.conn.search(students_ou, '(objectClass=organizationalUnit)'):
                 self.conn.add(students_ou, ['organizationalUnit'], {'ou': 'students', 'description': '学生信息组织单位'})
-                print("✅ 创建学生OU成功")
+                logger.info('✅ 创建学生OU成功')
             
             # 创建教师OU
             teachers_ou = f'ou=teachers,{self.LDAP_BASE_DN}'
             if not self.conn.search(teachers_ou, '(objectClass=organizationalUnit)'):
                 self.conn.add(teachers_ou, ['organizationalUnit'], {'ou': 'teachers', 'description': '教师信息组织单位'})
-                print("✅ 创建教师OU成功")
+                logger.info('✅ 创建教师OU成功')
             
             # 创建班级OU
             classes_ou = f'ou=classes,{self.LDAP_BASE_DN}'
             if not self.conn.search(classes_ou, '(objectClass=organizationalUnit)'):
                 self.conn.add(classes_ou, ['organizationalUnit'], {'ou': 'classes', 'description': '班级信息组织单位'})
-                print("✅ 创建班级OU成功")
+                logger.info('✅ 创建班级OU成功')
                 
-        except Exception as e:
-            print(f"❌ 创建OU结构失败: {e}")
+        except Exception:
+            logger.exception('❌ 创建OU结构失败')
+
+    def student_dn(self, uid):
+        """学生条目的DN（uid 按RDN规则转义），所有学生DN都经此构造"""
+        return f'uid={escape_rdn(uid)},ou=students,{self.LDAP_BASE_DN}'
+
+    @staticmethod
+    def student_attributes(uid, cn, sn, mail, password='123456', class_name=None, password_hash=None):
+        """按照LDAP标准构造学生条目属性，密码以带盐哈希存储（可传入预先算好的 password_hash）"""
+        attributes = {
+            'objectClass': ['inetOrgPerson'],
+            'uid': uid,
+            'cn': cn,  # 通用名称
+            'sn': sn,  # 姓氏
+            'mail': mail,
+            'userPassword': password_hash or hash_password(password)
+        }
+        
+        if class_name:
+            attributes['description'] = f'班级: {class_name}'
+        return attributes
+
+    def invalidate_listing(self):
+        """学生增删后使列表键缓存失效"""
+        self._pager.invalidate()
+
+    def ensure_index(self, max_age=None):
+        """返回学生索引，未加载或超过 max_age 秒未同步时全量重建
+
+        首次加载时其他请求等待；已有数据时只由一个线程重建，其余请求继续使用旧索引
+        """
+        max_age = self.LDAP_INDEX_RESYNC if max_age is None else max_age
+        index = self.student_index
+        if index.is_stale(max_age):
+            if self._index_lock.acquire(blocking=not index.loaded):
+                try:
+                    if index.is_stale(max_age):
+                        index.load(self.iter_students())
+                finally:
+                    self._index_lock.release()
+        return index
+
+    def update_index(self, uid, values):
+        """写操作成功后更新索引中的学生，values 为 {属性: 新值}"""
+        index = self.student_index
+        current = index.get(uid)
+        if current is None:
+            return
+        changes = {name: value for name, value in values.items() if name in ('cn', 'sn', 'mail', 'description')}
+        if changes:
+            index.upsert(current.replace(**changes))
+
+    def update_class_roster(self, conn, uid, class_name, previous=None):
+        """学生写操作成功后同步班级条目的成员
+
+        class_name 为新班级（None 表示不属于任何班级）；previous 为已知的原班级，
+        为 None 时先按 member 检索学生当前所在的班级
+        """
+        if not self.LDAP_CLASS_ROSTERS:
+            return True
+        try:
+            member_dn = self.student_dn(uid)
+            if previous is None:
+                ok = self.class_rosters.set_class(conn, member_dn, class_name)
+            else:
+                ok = self.class_rosters.move_member(conn, previous, class_name or UNASSIGNED_CLASS, member_dn)
+            if not ok:
+                logger.warning('⚠️ 班级名册同步失败: %s', conn.last_error, extra=fields(uid=uid, class_name=class_name))
+            return ok
+        except Exception:
+            logger.exception('❌ 班级名册同步错误', extra=fields(uid=uid, class_name=class_name))
+            return False
+
+    def join_class_rosters(self, conn, members):
+        """批量把新学生加入班级，members 为 {班级名称: [uid, ...]}，每个班级一次修改"""
+        if not self.LDAP_CLASS_ROSTERS:
+            return True
+        ok = True
+        for class_name, uids in members.items():
+            try:
+                if not self.class_rosters.add_members(conn, class_name, [self.student_dn(uid) for uid in uids]):
+                    logger.warning('⚠️ 班级名册同步失败: %s', conn.last_error,
+                                   extra=fields(class_name=class_name, students=len(uids)))
+                    ok = False
+            except Exception:
+                logger.exception('❌ 班级名册同步错误', extra=fields(class_name=class_name))
+                ok = False
+        return ok
 
     def add_student(self, uid, cn, sn, mail, password='123456', class_name=None):
         """增加学生数据"""
         try:
-            dn = f'uid={uid},ou=students,{self.LDAP_BASE_DN}'
+            dn = self.student_dn(uid)
             
             # 检查学生是否已存在
             if self.conn.search(dn, '(objectClass=inetOrgPerson)'):
-                print(f"⚠️  学生 {uid} 已存在")
+                logger.warning('⚠️ 学生已存在', extra=fields(uid=uid))
                 return False
             
-            attributes = {
-                'objectClass': ['inetOrgPerson'],
-                'uid': uid,
-                'cn': cn,  # 通用名称
-                'sn': sn,  # 姓氏
-                'mail': mail,
-                'userPassword': password
-            }
-            
-            if class_name:
-                attributes['description'] = f'班级: {class_name}'
+            attributes = self.student_attributes(uid, cn, sn, mail, password, class_name)
             
             if self.conn.add(dn, attributes=attributes):
-                print(f"✅ 学生 {uid} ({cn}) 添加成功")
+                self._pager.invalidate()
+                if self.student_index.loaded:
+                    self.student_index.upsert(StudentRecord.from_attributes(attributes))
+                self.update_class_roster(self.conn, uid, class_name, previous=UNASSIGNED_CLASS)
+                logger.info('✅ 学生添加成功', extra=fields(uid=uid, cn=cn))
                 return True
             else:
-                print(f"❌ 添加学生 {uid} 失败: {self.conn.last_error}")
+                logger.error('❌ 添加学生失败: %s', self.conn.last_error, extra=fields(uid=uid))
                 return False
                 
-        except Exception as e:
-            print(f"❌ 添加学生错误: {e}")
+        except Exception:
+            logger.exception('❌ 添加学生错误', extra=fields(uid=uid))
             return False
 
     def delete_student(self, uid):
         """删除学生数据"""
         try:
-            dn = f'uid={uid},ou=students,{self.LDAP_BASE_DN}'
+            dn = self.student_dn(uid)
             
             if self.conn.delete(dn):
-                print(f"✅ 学生 {uid} 删除成功")
+                self._pager.invalidate()
+                self.identity_cache.invalidate(uid)
+                self.student_index.remove(uid)
+                self.update_class_roster(self.conn, uid, None)
+                logger.info('✅ 学生删除成功', extra=fields(uid=uid))
                 return True
             else:
-                print(f"❌ 删除学生 {uid} 失败: {self.conn.last_error}")
+                logger.error('❌ 删除学生失败: %s', self.conn.last_error, extra=fields(uid=uid))
                 return False
                 
-        except Exception as e:
-            print(f"❌ 删除学生错误: {e}")
+        except Exception:
+            logger.exception('❌ 删除学生错误', extra=fields(uid=uid))
             return False
 
     def modify_student(self, uid, attribute, new_value):
         """修改学生数据"""
         try:
-            dn = f'uid={uid},ou=students,{self.LDAP_BASE_DN}'
-            changes = {attribute: [(MODIFY_REPLACE, [new_value])]}
+            dn = self.student_dn(uid)
+            stored_value = hash_password(new_value) if attribute == 'userPassword' else new_value
+            changes = {attribute: [(MODIFY_REPLACE, [stored_value])]}
             
             if self.conn.modify(dn, changes):
-                print(f"✅ 学生 {uid} 的 {attribute} 更新成功")
+                self.identity_cache.invalidate(uid)
+                self.update_index(uid, {attribute: new_value})
+                if attribute == 'description':
+                    self.update_class_roster(self.conn, uid, parse_class_name(new_value))
+                logger.info('✅ 学生信息更新成功', extra=fields(uid=uid, attribute=attribute))
                 return True
             else:
-                print(f"❌ 更新学生 {uid} 失败: {self.conn.last_error}")
+                logger.error('❌ 更新学生失败: %s', self.conn.last_error, extra=fields(uid=uid, attribute=attribute))
                 return False
                 
-        except Exception as e:
-            print(f"❌ 修改学生错误: {e}")
+        except Exception:
+            logger.exception('❌ 修改学生错误', extra=fields(uid=uid))
             return False
 
     def search_student(self, uid):
-        """查询单个学生数据"""
+        """查询单个学生数据，返回 StudentRecord"""
         try:
-            dn = f'uid={uid},ou=students,{self.LDAP_BASE_DN}'
-            self.conn.search(dn, '(objectClass=inetOrgPerson)', attributes=['*'])
+            dn = self.student_dn(uid)
+            self.conn.search(dn, '(objectClass=inetOrgPerson)', search_scope=BASE,
+                             attributes=StudentRecord.ATTRIBUTES)
             
-            if self.conn.entries:
-                student = self.conn.entries[0]
-                print(f"📋 学生信息 - {uid}:")
-                print(f"   姓名: {student.cn}")
-                print(f"   姓氏: {student.sn}")
-                print(f"   邮箱: {student.mail}")
-                if hasattr(student, 'description'):
-                    print(f"   班级: {student.description}")
+            if self.conn.response:
+                student = StudentRecord.from_raw(self.conn.response[0]['raw_attributes'])
+                logger.debug('📋 查询学生', extra=fields(uid=uid, sample=True))
                 return student
             else:
-                print(f"❌ 未找到学生 {uid}")
+                logger.debug('未找到学生', extra=fields(uid=uid))
                 return None
                 
-        except Exception as e:
-            print(f"❌ 查询学生错误: {e}")
+        except Exception:
+            logger.exception('❌ 查询学生错误', extra=fields(uid=uid))
+            return None
+
+    def get_student_entry(self, uid):
+        """查询单个学生及其变更标记，返回 (StudentRecord, 变更标记, 修改时间)，不存在时返回 None
+
+        变更标记优先取 entryCSN，其次 modifyTimestamp；服务器不提供时为 None
+        """
+        # ldap3 按服务器 schema 校验属性名，只请求 schema 中存在的变更标记
+        schema = self.conn.server.schema
+        versions = tuple(name for name in ENTRY_VERSION_ATTRIBUTES
+                         if schema is None or name in schema.attribute_types)
+        self.conn.search(self.student_dn(uid), '(objectClass=inetOrgPerson)', search_scope=BASE,
+                         attributes=StudentRecord.ATTRIBUTES + versions)
+        if not self.conn.response:
             return None
+        raw = self.conn.response[0]['raw_attributes']
+        csn = _first_value(raw.get('entryCSN'))
+        timestamp = _first_value(raw.get('modifyTimestamp'))
+        return StudentRecord.from_raw(raw), csn or timestamp, parse_generalized_time(timestamp)
 
-    def list_students(self, page=1, per_page=8):
-        """列出学生（支持分页）"""
+    def list_students(self, page=1, per_page=8, cursor=None):
+        """列出学生（支持分页）
+
+        先取缓存的uid键列表定位当前页，再只读取这一页的条目；
+        cursor 为上一页返回的 next_cursor，传入时按游标翻页
+        """
         try:
-            self.conn.search(f'ou=students,{self.LDAP_BASE_DN}', '(objectClass=inetOrgPerson)', 
-                           attributes=['uid', 'cn', 'sn', 'mail', 'description'])
-            
-            all_students = []
-            for entry in self.conn.entries:
-                # 解析班级信息
-                class_name = "未分配"
-                if hasattr(entry, 'description'):
-                    desc = str(entry.description)
-                    if desc.startswith('班级: '):
-                        class_name = desc[3:]  # 去掉"班级: "前缀
-                    elif desc.startswith('role:'):
-                        class_name = "管理员"
-                
-                all_students.append({
-                    'uid': str(entry.uid),
-                    'cn': str(entry.cn),
-                    'sn': str(entry.sn),
-                    'mail': str(entry.mail),
-                    'class_name': class_name
-                })
+            search_base = f'ou=students,{self.LDAP_BASE_DN}'
+            keys = self._pager.keys(self.conn, search_base)
+            total = len(keys)
             
-            # 分页计算
-            total = len(all_students)
-            start = (page - 1) * per_page
-            end = start + per_page
-            students = all_students[start:end]
+            cursor_uid = decode_cursor(cursor) if cursor else None
+            if cursor_uid is not None:
+                page_uids, start = StudentPager.slice_after(keys, cursor_uid, per_page)
+                page = start // per_page + 1
+            else:
+                start = (page - 1) * per_page
+                page_uids = StudentPager.slice_page(keys, page, per_page)
             
-            # 分页信息
-            total_pages = (total + per_page - 1) // per_page
-            has_prev = page > 1
-            has_next = page < total_pages
+            page_students = {}
+            if page_uids:
+                self.conn.search(search_base, uid_filter(page_uids), attributes=StudentRecord.ATTRIBUTES)
+                for item in self.conn.response:
+                    if item.get('type') == 'searchResEntry':
+                        student = StudentRecord.from_raw(item['raw_attributes'])
+                        page_students[student.uid] = student
             
-            print(f"📊 共找到 {total} 名学生，第 {page}/{total_pages} 页")
-            for student in students:
-                print(f"   {student['uid']}: {student['cn']} ({student['class_name']})")
+            # 按键列表的顺序输出当前页
+            students = [page_students[uid] for uid in page_uids if uid in page_students]
             
-            return {
-                'students': students,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': total,
-                    'total_pages': total_pages,
-                    'has_prev': has_prev,
-                    'has_next': has_next,
-                    'prev_page': page - 1 if has_prev else None,
-                    'next_page': page + 1 if has_next else None
-                }
-            }
+            result = page_result(students, page, per_page, total, start, page_uids[-1] if page_uids else None)
+            logger.debug('📊 列出学生', extra=fields(total=total, page=page,
+                                                   total_pages=result['pagination']['total_pages'],
+                                                   returned=len(students), sample=True))
+            return result
             
-        except Exception as e:
-            print(f"❌ 列出学生错误: {e}")
-            return {
-                'students': [],
-                'pagination': {
-                    'page': 1,
-                    'per_page': per_page,
-                    'total': 0,
-                    'total_pages': 0,
-                    'has_prev': False,
-                    'has_next': False,
-                    'prev_page': None,
-                    'next_page': None
-                }
-            }
-
-    def import_students_from_csv(self, csv_file):
-        """批量导入学生数据（CSV文件）"""
+        except Exception:
+            logger.exception('❌ 列出学生错误')
+            return empty_page(per_page)
+
+    def iter_students(self, page_size=1000, search_filter='(objectClass=inetOrgPerson)'):
+        """分页遍历全部学生，逐条产出 StudentRecord（内存占用只与页大小有关）"""
+        search_base = f'ou=students,{self.LDAP_BASE_DN}'
+        with self.connection() as conn:
+            for page in paged_search(conn, search_base, search_filter, INDEX_ATTRIBUTES, page_size):
+                for item in page:
+                    yield StudentRecord.from_raw(item['raw_attributes'])
+
+    def ensure_class_rosters(self):
+        """班级条目是否完整可用
+
+        每个进程首次使用时检查 ou=classes 上的重建标记；没有标记（已有目录首次启用，或上次重建中途失败）时
+        按学生的 description 自动重建一次。未启用或重建失败时返回 False，调用方改为按 description 检索
+        """
+        if not self.LDAP_CLASS_ROSTERS:
+            return False
+        if self._rosters_ready:
+            return True
+        with self._rosters_lock:
+            if not self._rosters_ready:
+                try:
+                    with self.pool.connection() as conn:
+                        built = self.class_rosters.is_built(conn)
+                except Exception:
+                    logger.exception('❌ 检查班级名册错误')
+                    return False
+                if not built:
+                    logger.info('🏫 班级名册尚未建立，按学生的 description 自动重建')
+                    built = self.rebuild_class_rosters() is not None
+                self._rosters_ready = built
+        return self._rosters_ready
+
+    def _class_records(self, conn, class_name):
+        """按 description 检索某班学生（班级条目不可用时使用）"""
+        search_base = f'ou=students,{self.LDAP_BASE_DN}'
+        return list(iter_records(conn, search_base, [class_name]))
+
+    def class_counts(self):
+        """各班人数 {班级名称: 人数}，读取 ou=classes 下的班级条目，失败时返回 None"""
+        try:
+            if not self.ensure_class_rosters():
+                counts = {}
+                for record in self.iter_students():
+                    if is_real_class(record.class_name) and not record.role:
+                        counts[record.class_name] = counts.get(record.class_name, 0) + 1
+                return counts
+            with self.pool.connection() as conn:
+                return self.class_rosters.counts(conn)
+        except Exception:
+            logger.exception('❌ 统计班级人数错误')
+            return None
+
+    def class_roster(self, class_name, batch_size=200):
+        """班级成员的 StudentRecord 列表（按uid排序），班级不存在时返回 None
+
+        先读一次班级条目得到成员，再按 uid 精确匹配分批取回学生，代价只与班级人数有关
+        """
+        try:
+            search_base = f'ou=students,{self.LDAP_BASE_DN}'
+            if not self.ensure_class_rosters():
+                with self.pool.connection() as conn:
+                    records = [record for record in self._class_records(conn, class_name) if not record.role]
+                return sorted(records, key=lambda record: record.uid) or None
+            with self.pool.connection() as conn:
+                uids = self.class_rosters.members(conn, class_name)
+                if uids is None:
+                    return None
+                records = {}
+                for i in range(0, len(uids), batch_size):
+                    conn.search(search_base, uid_filter(uids[i:i + batch_size]), search_scope=SUBTREE,
+                                attributes=list(StudentRecord.ATTRIBUTES))
+                    for item in conn.response:
+                        if item.get('type') == 'searchResEntry':
+                            record = StudentRecord.from_raw(item['raw_attributes'])
+                            records[record.uid] = record
+            return [records[uid] for uid in uids if uid in records]
+        except Exception:
+            logger.exception('❌ 查询班级名册错误', extra=fields(class_name=class_name))
+            return None
+
+    def rebuild_class_rosters(self):
+        """按学生的 description 重建全部班级条目，返回 {班级名称: 人数}，失败时返回 None"""
+        try:
+            records = list(self.iter_students())
+            with self.pool.connection() as conn:
+                counts = self.class_rosters.rebuild(conn, records, self.student_dn)
+            self._rosters_ready = True
+            logger.info('✅ 班级名册重建完成', extra=fields(classes=len(counts), students=sum(counts.values())))
+            return counts
+        except Exception:
+            logger.exception('❌ 重建班级名册错误')
+            return None
+
+    def export_students(self, fmt='csv', columns=None, class_names=None, page_size=1000):
+        """导出学生名册，返回逐块产出文件内容（bytes）的生成器
+
+        - fmt: csv 或 xlsx
+        - columns: 要导出的列（uid/cn/sn/mail/class_name），默认全部
+        - class_names: 只导出这些班级的学生
+        格式或列名不合法时立即抛出 ValueError；生成器自己从连接池借出连接，可在请求结束后继续迭代
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        columns = resolve_columns(columns)
+        return self._export(fmt, columns, class_names, page_size)
+
+    def _export(self, fmt, columns, class_names, page_size):
+        search_base = f'ou=students,{self.LDAP_BASE_DN}'
+        writer = iter_xlsx if fmt == 'xlsx' else iter_csv
+        with self.pool.connection() as conn:
+            yield from writer(iter_records(conn, search_base, class_names, page_size), columns)
+
+    def select_students(self, uids=None, class_name=None):
+        """解析批量操作的目标，返回 [(uid, 已知的原班级或 None)]
+
+        uids 和 class_name 二选一；按班级选择时成员来自班级条目（未启用或不可用时按 description 检索）。
+        目标为空或超过 LDAP_BATCH_MAX_ITEMS 时抛出 ValueError
+        """
+        if bool(uids) == bool(class_name):
+            raise ValueError('请指定学生列表或班级之一')
+        if uids and not isinstance(uids, (list, tuple, set)):
+            raise ValueError('uids 必须是用户ID列表')
+        if uids:
+            selected = [(uid, None) for uid in dict.fromkeys(str(uid).strip() for uid in uids) if uid]
+        else:
+            rosters = self.ensure_class_rosters()
+            with self.pool.connection() as conn:
+                if rosters:
+                    members = self.class_rosters.members(conn, class_name) or []
+                else:
+                    members = [record.uid for record in self._class_records(conn, class_name)]
+            selected = [(uid, class_name) for uid in members]
+        if not selected:
+            raise ValueError('没有选中任何学生')
+        if len(selected) > self.LDAP_BATCH_MAX_ITEMS:
+            raise ValueError(f'单次最多操作 {self.LDAP_BATCH_MAX_ITEMS} 名学生')
+        return selected
+
+    def protected_students(self, uids, batch_size=200):
+        """带角色（如管理员）的uid集合：批量删除和调整班级时跳过，与名册对账的保护规则一致"""
+        uids = list(uids)
+        search_base = f'ou=students,{self.LDAP_BASE_DN}'
+        protected = set()
+        with self.pool.connection() as conn:
+            for i in range(0, len(uids), batch_size):
+                conn.search(search_base, uid_filter(uids[i:i + batch_size]), search_scope=SUBTREE,
+                            attributes=StudentRecord.ATTRIBUTES)
+                for item in conn.response:
+                    if item.get('type') == 'searchResEntry':
+                        record = StudentRecord.from_raw(item['raw_attributes'])
+                        if record.role:
+                            protected.add(record.uid)
+        return protected
+
+    def batch_update_students(self, items, workers=None, batch_size=100):
+        """批量修改学生，items 为 [{'uid': ..., 'cn'/'sn'/'mail'/'class_name'/'password': ...}]，返回 BatchResult"""
+        if not items:
+            raise ValueError('没有选中任何学生')
+        if len(items) > self.LDAP_BATCH_MAX_ITEMS:
+            raise ValueError(f'单次最多操作 {self.LDAP_BATCH_MAX_ITEMS} 名学生')
+        targets = []
+        for item in items:
+            # 值为 null 的字段视为未提供
+            changes = {name: str(value).strip() for name, value in item.items() if name != 'uid' and value is not None}
+            targets.append((str(item.get('uid') or '').strip(), changes, None))
+        result = BatchResult('update')
+        # 改写 description 会丢掉账号的角色，带角色的账号不调整班级
+        protected = self.protected_students(uid for uid, changes, _ in targets if uid and 'class_name' in changes)
+        pending = []
+        for target in targets:
+            uid, changes, _ = target
+            if not uid:
+                result.add(uid, STATUS_INVALID, '缺少用户ID')
+            elif uid in protected:
+                result.add(uid, STATUS_SKIPPED, '不能调整带角色账号（如管理员）的班级')
+            else:
+                pending.append(target)
+        editor = BulkEditor(self, workers or self.LDAP_BATCH_WORKERS, batch_size)
+        editor.update(pending, result)
+        logger.info('✅ 批量修改完成', extra=fields(total=len(items), succeeded=result.success_count,
+                                                  elapsed=round(result.elapsed, 2)))
+        return result
+
+    def batch_delete_students(self, uids=None, class_name=None, workers=None, batch_size=100, exclude=()):
+        """批量删除一组学生或整个班级，返回 BatchResult
+
+        exclude 中的uid（如当前登录的管理员）和带角色的账号跳过
+        """
+        selected = self.select_students(uids, class_name)
+        protected = self.protected_students(uid for uid, _ in selected)
+        result = BatchResult('delete')
+        targets = []
+        for uid, previous in selected:
+            if uid in exclude:
+                result.add(uid, STATUS_SKIPPED, '不能删除当前登录的账号')
+            elif uid in protected:
+                result.add(uid, STATUS_SKIPPED, '不能批量删除带角色的账号（如管理员）')
+            else:
+                targets.append((uid, previous))
+        BulkEditor(self, workers or self.LDAP_BATCH_WORKERS, batch_size).delete(targets, result)
+        logger.info('✅ 批量删除完成', extra=fields(total=len(selected), class_name=class_name,
+                                                  succeeded=result.success_count, elapsed=round(result.elapsed, 2)))
+        return result
+
+    def reassign_class(self, new_class, uids=None, from_class=None, workers=None, batch_size=100):
+        """把一组学生或整个班级调整到 new_class（空字符串表示未分配），返回 BatchResult"""
+        new_class = (new_class or '').strip()
+        selected = self.select_students(uids, from_class)
+        protected = self.protected_students(uid for uid, _ in selected)
+        result = BatchResult('update')
+        items = []
+        for uid, previous in selected:
+            if uid in protected:
+                result.add(uid, STATUS_SKIPPED, '不能调整带角色账号（如管理员）的班级')
+            else:
+                items.append((uid, {'class_name': new_class}, previous))
+        BulkEditor(self, workers or self.LDAP_BATCH_WORKERS, batch_size).update(items, result)
+        logger.info('✅ 批量调整班级完成', extra=fields(total=len(items), from_class=from_class, class_name=new_class,
+                                                      succeeded=result.success_count, elapsed=round(result.elapsed, 2)))
+        return result
+
+    def import_students_from_csv(self, csv_file, workers=4, batch_size=200, progress=None,
+                                 stream=False, chunk_size=1000):
+        """批量导入学生数据（CSV文件），返回 ImportReport
+
+        stream=True 时按 chunk_size 分块读取并逐块写入，适合超大文件
+        """
         try:
             if not os.path.exists(csv_file):
-                print(f"❌ 文件不存在: {csv_file}")
+                logger.error('❌ 文件不存在', extra=fields(file=csv_file))
                 return False
             
-            students = pd.read_csv(csv_file)
-            success_count = 0
-            error_count = 0
+            importer = BulkImporter(self, workers, batch_size, progress)
+            if stream:
+                logger.info('📁 开始流式导入CSV文件', extra=fields(file=csv_file))
+                report = importer.run_stream(iter_csv_chunks(csv_file, chunk_size), csv_file)
+                self._log_import_report(report)
+                return report
             
-            print(f"📁 开始导入CSV文件: {csv_file}")
-            print(f"📊 共 {len(students)} 条记录")
+            # 按字符串读取，避免 001 这类学号被解析成数字
+            students = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
             
-            for index, row in students.iterrows():
-                try:
-                    uid = str(row['uid']).strip()
-                    cn = str(row['cn']).strip()
-                    sn = str(row['sn']).strip()
-                    mail = str(row['mail']).strip()
-                    password = str(row.get('password', '123456')).strip()
-                    class_name = str(row.get('class_name', '')).strip() if 'class_name' in row else None
-                    
-                    if self.add_student(uid, cn, sn, mail, password, class_name):
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        
-                except Exception as e:
-                    print(f"❌ 导入第 {index+1} 行数据失败: {e}")
-                    error_count += 1
+            logger.info('📁 开始导入CSV文件', extra=fields(file=csv_file, rows=len(students)))
             
-            print(f"✅ 导入完成: 成功 {success_count} 条, 失败 {error_count} 条")
-            return True
+            report = importer.run(students, csv_file)
+            self._log_import_report(report)
+            return report
             
-        except Exception as e:
-            print(f"❌ 导入CSV文件错误: {e}")
+        except Exception:
+            logger.exception('❌ 导入CSV文件错误', extra=fields(file=csv_file))
             return False
 
-    def import_students_from_excel(self, excel_file):
-        """批量导入学生数据（Excel文件）"""
+    def import_students_from_excel(self, excel_file, workers=4, batch_size=200, progress=None,
+                                   stream=False, chunk_size=1000):
+        """批量导入学生数据（Excel文件），返回 ImportReport
+
+        stream=True 时用 openpyxl 只读模式逐行读取（仅支持xlsx）
+        """
         try:
             if not os.path.exists(excel_file):
-                print(f"❌ 文件不存在: {excel_file}")
+                logger.error('❌ 文件不存在', extra=fields(file=excel_file))
                 return False
             
-            students = pd.read_excel(excel_file)
-            success_count = 0
-            error_count = 0
+            importer = BulkImporter(self, workers, batch_size, progress)
+            if stream and excel_file.lower().endswith('.xlsx'):
+                logger.info('📁 开始流式导入Excel文件', extra=fields(file=excel_file))
+                report = importer.run_stream(iter_xlsx_chunks(excel_file, chunk_size), excel_file)
+                self._log_import_report(report)
+                return report
             
-            print(f"📁 开始导入Excel文件: {excel_file}")
-            print(f"📊 共 {len(students)} 条记录")
+            students = pd.read_excel(excel_file, dtype=str)
             
-            for index, row in students.iterrows():
-                try:
-                    uid = str(row['uid']).strip()
-                    cn = str(row['cn']).strip()
-                    sn = str(row['sn']).strip()
-                    mail = str(row['mail']).strip()
-                    password = str(row.get('password', '123456')).strip()
-                    class_name = str(row.get('class_name', '')).strip() if 'class_name' in row else None
-                    
-                    if self.add_student(uid, cn, sn, mail, password, class_name):
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        
-                except Exception as e:
-                    print(f"❌ 导入第 {index+1} 行数据失败: {e}")
-                    error_count += 1
+            logger.info('📁 开始导入Excel文件', extra=fields(file=excel_file, rows=len(students)))
             
-            print(f"✅ 导入完成: 成功 {success_count} 条, 失败 {error_count} 条")
-            return True
+            report = importer.run(students, excel_file)
+            self._log_import_report(report)
+            return report
             
-        except Exception as e:
-            print(f"❌ 导入Excel文件错误: {e}")
+        except Exception:
+            logger.exception('❌ 导入Excel文件错误', extra=fields(file=excel_file))
+            return False
+
+    def _log_import_report(self, report, max_failed_rows=20):
+        """记录导入结果汇总，失败行只附带前 max_failed_rows 条（完整明细在 ImportReport 中）"""
+        failed = [item for item in report.rows if item['status'] != STATUS_ADDED]
+        if failed:
+            logger.warning('❌ 部分行导入失败', extra=fields(source=report.source, failed=len(failed),
+                                                            rows=failed[:max_failed_rows]))
+        logger.info('✅ 导入完成', extra=fields(source=report.source, added=report.success_count,
+                                                errors=report.error_count, elapsed=round(report.elapsed, 2),
+                                                rows_per_sec=round(report.rows_per_sec)))
+
+    def reconcile_students(self, roster_file, apply=False, delete=False, workers=4, batch_size=200):
+        """按完整名册同步目录，返回 ReconcileReport
+
+        默认只比较并报告差异；apply=True 时写入最小变更集，
+        delete=True 时同时删除名册中没有的学生（带角色的账号始终保留）
+        """
+        try:
+            if not os.path.exists(roster_file):
+                logger.error('❌ 文件不存在', extra=fields(file=roster_file))
+                return False
+
+            if roster_file.lower().endswith(('.xlsx', '.xls')):
+                roster = pd.read_excel(roster_file, dtype=str)
+            else:
+                roster = pd.read_csv(roster_file, dtype=str, keep_default_na=False)
+
+            snapshot = directory_snapshot(self)
+            plan = plan_reconcile(roster, snapshot, roster_file, delete=delete)
+            logger.info('🔍 名册对账', extra=fields(file=roster_file, roster=plan.roster_total,
+                                                  directory=plan.directory_total, adds=len(plan.adds),
+                                                  modifies=len(plan.modifies), deletes=len(plan.deletes),
+                                                  unchanged=plan.unchanged, invalid=len(plan.invalid),
+                                                  protected=len(plan.protected)))
+            if not apply or not plan.change_count:
+                return ReconcileReport(plan)
+
+            report = Reconciler(self, workers, batch_size).apply(plan, snapshot)
+            if report.failed:
+                logger.warning('❌ 部分变更写入失败', extra=fields(source=roster_file, failed=len(report.failed),
+                                                                 rows=report.failed[:20]))
+            logger.info('✅ 名册同步完成', extra=fields(source=roster_file, elapsed=round(report.elapsed, 2),
+                                                      **report.applied))
+            return report
+
+        except Exception:
+            logger.exception('❌ 名册对账错误', extra=fields(file=roster_file))
             return False
 
 
 def main():
     """主函数 - 演示如何使用"""
+    setup_logging(fmt='text')
     manager = StudentLDAPManager()
     
     # 连接LDAP服务器
@@ -360,7 +979,30 @@ def main():
     
     # 断开连接
     manager.disconnect()
+    manager.close_pool()
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ['migrate-passwords']:
+        # python student_db_manager.py migrate-passwords [--dry-run]
+        setup_logging(fmt='text')
+        manager = StudentLDAPManager()
+        manager.migrate_passwords(dry_run='--dry-run' in sys.argv)
+        manager.close_pool()
+    elif sys.argv[1:2] == ['rebuild-classes']:
+        # python student_db_manager.py rebuild-classes
+        setup_logging(fmt='text')
+        manager = StudentLDAPManager()
+        manager.rebuild_class_rosters()
+        manager.close_pool()
+    elif sys.argv[1:2] == ['reconcile'] and len(sys.argv) > 2:
+        # python student_db_manager.py reconcile <名册文件> [--apply] [--delete]
+        setup_logging(fmt='text')
+        manager = StudentLDAPManager()
+        report = manager.reconcile_students(sys.argv[2], apply='--apply' in sys.argv,
+                                            delete='--delete' in sys.argv)
+        if report:
+            print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+        manager.close_pool()
+    else:
+        main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学生名册导出
+分页检索目录并逐条生成 CSV 或 xlsx，导出内存占用只与页大小有关；
+列名与导入格式一致，导出的CSV可直接再导入
+"""
+
+import csv
+import io
+import re
+import tempfile
+from ldap3.utils.conv import escape_filter_chars
+from student_paging import paged_search
+from student_record import StudentRecord, CLASS_PREFIX, ADMIN_CLASS, UNASSIGNED_CLASS, RECORD_COLUMNS
+
+EXPORT_COLUMNS = list(RECORD_COLUMNS)
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+# 以这些字符开头的单元格会被电子表格当作公式执行（CSV注入），导出时在前面加单引号
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+FORMULA_GUARD = "'"
+# 需要加单引号的值：以公式字符开头，或以若干单引号加公式字符开头（原值本身带引号时也加一个，
+# 导入时只去掉一个，导出和导入互逆）
+FORMULA_GUARDED = re.compile('^' + re.escape(FORMULA_GUARD) + '*[' + re.escape(''.join(FORMULA_PREFIXES)) + ']')
+
+# CSV 每攒够这么多行输出一个分块
+CSV_FLUSH_ROWS = 500
+# xlsx 文件写完后按该大小分块读出
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def export_filter(class_names=None):
+    """构造导出用的过滤器：只含普通班级时由服务器按 description 过滤"""
+    base = '(objectClass=inetOrgPerson)'
+    if not class_names or any(name in (ADMIN_CLASS, UNASSIGNED_CLASS) for name in class_names):
+        # 管理员和未分配不对应固定的 description 值，取回后再按解析结果过滤
+        return base
+    terms = ''.join(f'(description={escape_filter_chars(CLASS_PREFIX + name)})' for name in class_names)
+    return f'(&{base}(|{terms}))'
+
+
+def iter_records(conn, search_base, class_names=None, page_size=1000):
+    """分页检索学生，逐条产出 StudentRecord"""
+    wanted = set(class_names) if class_names else None
+    for page in paged_search(conn, search_base, export_filter(class_names), StudentRecord.ATTRIBUTES, page_size):
+        for item in page:
+            record = StudentRecord.from_raw(item['raw_attributes'])
+            if wanted is None or record.class_name in wanted:
+                yield record
+
+
+def cell_value(value):
+    """单元格的导出值：可能被当作公式的值前加单引号，电子表格按文本显示（再导入时去掉）"""
+    if value and FORMULA_GUARDED.match(value):
+        return FORMULA_GUARD + value
+    return value
+
+
+def export_rows(records, columns):
+    """逐条产出导出行
+
+    带角色的账号（管理员）不是名册中的学生，跳过：其班级显示为“管理员”，再导入会变成一个真实班级
+    """
+    for record in records:
+        if not record.role:
+            yield [cell_value(getattr(record, name)) for name in columns]
+
+
+def iter_csv(records, columns):
+    """逐块产出 UTF-8 编码的CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    for row in export_rows(records, columns):
+        writer.writerow(row)
+        rows += 1
+        if rows % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_xlsx(records, columns):
+    """用 openpyxl 只写模式生成xlsx并分块产出
+
+    只写模式下每行直接写入临时文件，不在内存中保留单元格；
+    xlsx 是zip容器，目录位于文件末尾，写完整个工作簿后才能输出
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('students')
+    sheet.append(columns)
+    for row in export_rows(records, columns):
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学生批量导入
+整表向量化校验、一次性预取已存在的uid、多个连接并行添加，并生成逐行导入报告；
+大文件可按固定大小的分块流式读取，边读边写入
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from student_paging import paged_search
+from student_record import StudentRecord
+from student_export import EXPORT_COLUMNS, FORMULA_GUARD, FORMULA_GUARDED
+from credentials import hash_many
+
+REQUIRED_COLUMNS = ['uid', 'cn', 'sn', 'mail']
+OPTIONAL_COLUMNS = {'password': '123456', 'class_name': ''}
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+# 导出时为防止公式注入在值前加的单引号：只在其后仍是需要加引号的值时才去掉，其他以单引号开头的值原样保留
+FORMULA_GUARD_PATTERN = '^' + re.escape(FORMULA_GUARD) + '(?=' + FORMULA_GUARDED.pattern[1:] + ')'
+
+# 行状态
+STATUS_ADDED = 'added'
+STATUS_EXISTS = 'exists'
+STATUS_INVALID = 'invalid'
+STATUS_FAILED = 'failed'
+
+
+class ImportReport:
+    """导入结果：逐行状态、耗时和吞吐量
+
+    keep_success_rows=False 时只保留失败行的明细（流式导入时内存不随文件增长）
+    """
+
+    def __init__(self, source, keep_success_rows=True):
+        self.source = source
+        self.keep_success_rows = keep_success_rows
+        self.rows = []
+        self.counts = {STATUS_ADDED: 0, STATUS_EXISTS: 0, STATUS_INVALID: 0, STATUS_FAILED: 0}
+        self.started_at = time.time()
+        self.first_write_after = None  # 第一条记录写入LDAP距开始的秒数
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_row(self, row, uid, status, message='', elapsed_ms=0.0):
+        with self._lock:
+            self.counts[status] += 1
+            if status == STATUS_ADDED:
+                if self.first_write_after is None:
+                    self.first_write_after = time.perf_counter() - self._started
+                if not self.keep_success_rows:
+                    return
+            self.rows.append({
+                'row': row,
+                'uid': uid,
+                'status': status,
+                'message': message,
+                'elapsed_ms': round(elapsed_ms, 3)
+            })
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._started
+        self.rows.sort(key=lambda item: item['row'])
+        return self
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def count(self, status):
+        return self.counts[status]
+
+    @property
+    def success_count(self):
+        return self.count(STATUS_ADDED)
+
+    @property
+    def error_count(self):
+        return self.total - self.success_count
+
+    @property
+    def rows_per_sec(self):
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self, include_rows=True):
+        result = {
+            'source': self.source,
+            'total': self.total,
+            'added': self.success_count,
+            'exists': self.count(STATUS_EXISTS),
+            'invalid': self.count(STATUS_INVALID),
+            'failed': self.count(STATUS_FAILED),
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'first_write_after': round(self.first_write_after, 3) if self.first_write_after is not None else None
+        }
+        if include_rows:
+            result['rows'] = self.rows
+        return result
+
+
+def prepare_students(frame):
+    """整表清洗和校验
+
+    返回 (records, invalid)：records 为可导入的记录字典列表，
+    invalid 为 (行号, uid, 原因) 列表；行号从1开始，与原始数据行对应
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"缺少必需的列: {', '.join(missing)}")
+
+    data = pd.DataFrame(index=frame.index)
+    for column in REQUIRED_COLUMNS:
+        data[column] = frame[column].fillna('').astype(str).str.strip()
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column in frame.columns:
+            data[column] = frame[column].fillna(default).astype(str).str.strip()
+        else:
+            data[column] = default
+    # 去掉导出时为防止公式注入加的单引号，导出的文件可原样再导入
+    for column in EXPORT_COLUMNS:
+        data[column] = data[column].str.replace(FORMULA_GUARD_PATTERN, '', regex=True)
+    data['row'] = frame.index + 1
+
+    # 逐条件生成原因，保留第一个失败原因
+    reason = pd.Series('', index=data.index)
+    empty = (data[REQUIRED_COLUMNS] == '').any(axis=1)
+    reason = reason.mask(empty & (reason == ''), '用户ID、姓名、姓氏和邮箱不能为空')
+    bad_mail = ~data['mail'].str.match(EMAIL_PATTERN)
+    reason = reason.mask(bad_mail & (reason == ''), '邮箱格式不正确')
+    duplicated = data['uid'].duplicated(keep='first') & (data['uid'] != '')
+    reason = reason.mask(duplicated & (reason == ''), '文件中用户ID重复')
+
+    bad = reason != ''
+    invalid = list(zip(data.loc[bad, 'row'].tolist(),
+                       data.loc[bad, 'uid'].tolist(),
+                       reason[bad].tolist()))
+    records = data.loc[~bad].to_dict('records')
+    return records, invalid
+
+
+class BulkImporter:
+    """批量导入流水线
+
+    - workers: 并行添加的线程数，每个线程从连接池借出独立连接
+    - batch_size: 每个线程一次借出连接后连续添加的记录数
+    - progress: 可选回调 progress(done, total)
+    """
+
+    def __init__(self, manager, workers=4, batch_size=200, progress=None):
+        self.manager = manager
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.progress = progress
+        self._done = 0
+        self._total = 0
+        self._progress_lock = threading.Lock()
+
+    def fetch_existing_uids(self):
+        """一次分页扫描取回所有已存在的uid，代替逐行存在性查询"""
+        search_base = f'ou=students,{self.manager.LDAP_BASE_DN}'
+        existing = set()
+        with self.manager.connection() as conn:
+            for page in paged_search(conn, search_base, '(objectClass=inetOrgPerson)', ['uid'], page_size=1000):
+                for item in page:
+                    uid = item['attributes'].get('uid')
+                    if uid:
+                        existing.add(uid[0] if isinstance(uid, list) else uid)
+        return existing
+
+    def _advance(self, n):
+        if not self.progress:
+            return
+        with self._progress_lock:
+            self._done += n
+            done, total = self._done, self._total
+        self.progress(done, total)
+
+    def _add_batch(self, batch, report):
+        """在一个借出的连接上依次添加一批记录"""
+        manager = self.manager
+        joined = {}
+        with manager.pool.connection() as conn:
+            for record in batch:
+                started = time.perf_counter()
+                uid = record['uid']
+                try:
+                    attributes = manager.student_attributes(
+                        uid, record['cn'], record['sn'], record['mail'],
+                        class_name=record['class_name'] or None,
+                        password_hash=record['password_hash'])
+                    if conn.add(manager.student_dn(uid), attributes=attributes):
+                        if manager.student_index.loaded:
+                            manager.student_index.upsert(StudentRecord.from_attributes(attributes))
+                        if record['class_name']:
+                            joined.setdefault(record['class_name'], []).append(uid)
+                        report.add_row(record['row'], uid, STATUS_ADDED,
+                                       elapsed_ms=(time.perf_counter() - started) * 1000)
+                    else:
+                        status = STATUS_EXISTS if conn.result.get('description') == 'entryAlreadyExists' else STATUS_FAILED
+                        report.add_row(record['row'], uid, status, str(conn.last_error),
+                                       (time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    report.add_row(record['row'], uid, STATUS_FAILED, str(e),
+                                   (time.perf_counter() - started) * 1000)
+            # 整批新增的学生按班级一次加入班级条目
+            manager.join_class_rosters(conn, joined)
+        self._advance(len(batch))
+
+    def import_records(self, records, report, existing=None):
+        """添加一组已校验的记录，已存在的uid直接跳过"""
+        if existing is None:
+            existing = self.fetch_existing_uids()
+
+        pending = []
+        for record in records:
+            if record['uid'] in existing:
+                report.add_row(record['row'], record['uid'], STATUS_EXISTS, '用户已存在')
+            else:
+                pending.append(record)
+                existing.add(record['uid'])
+        self._advance(len(records) - len(pending))
+
+        # 整批预先计算密码哈希，慢哈希方案交给进程池并行
+        for record, password_hash in zip(pending, hash_many(record['password'] for record in pending)):
+            record['password_hash'] = password_hash
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        if len(batches) <= 1 or self.workers == 1:
+            for batch in batches:
+                self._add_batch(batch, report)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(self._add_batch, batch, report) for batch in batches]:
+                    future.result()
+
+        if pending:
+            self.manager.invalidate_listing()
+        return report
+
+    def _import_frame(self, frame, report, existing):
+        records, invalid = prepare_students(frame)
+        for row, uid, reason in invalid:
+            report.add_row(row, uid, STATUS_INVALID, reason)
+        self._advance(len(invalid))
+        self.import_records(records, report, existing)
+
+    def run(self, frame, source):
+        """导入整张表，返回 ImportReport"""
+        report = ImportReport(source)
+        self._total = len(frame)
+        self._import_frame(frame, report, self.fetch_existing_uids())
+        return report.finish()
+
+    def run_stream(self, chunks, source, total=None):
+        """逐块导入，chunks 为产出 DataFrame 的迭代器
+
+        已存在的uid只预取一次，跨块的重复uid同样会被识别；
+        报告只保留失败行明细，峰值内存只与分块大小有关
+        """
+        report = ImportReport(source, keep_success_rows=False)
+        self._total = total or 0
+        existing = self.fetch_existing_uids()
+        for frame in chunks:
+            if not total:
+                self._total += len(frame)
+            self._import_frame(frame, report, existing)
+        return report.finish()
+
+
+def iter_csv_chunks(path, chunk_size=1000):
+    """分块读取CSV，每块是行号连续的 DataFrame"""
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+def iter_xlsx_chunks(path, chunk_size=1000):
+    """用 openpyxl 只读模式逐行读取xlsx，按块产出 DataFrame"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name).strip() if name is not None else '' for name in header]
+
+        buffer = []
+        start = 0
+        for values in rows:
+            if values is None or all(value is None for value in values):
+                continue
+            buffer.append(['' if value is None else str(value) for value in values])
+            if len(buffer) >= chunk_size:
+                yield _make_chunk(buffer, columns, start)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _make_chunk(buffer, columns, start)
+    finally:
+        workbook.close()
+
+
+def _make_chunk(rows, columns, start):
+    width = len(columns)
+    rows = [row[:width] + [''] * (width - len(row)) for row in rows]
+    return pd.DataFrame(rows, columns=columns, index=pd.RangeIndex(start, start + len(rows)))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内学生目录索引
+一次全量扫描建立 uid 主索引和班级、邮箱二级索引，支持 cn/uid 前缀与子串搜索，
+写操作后增量更新，LDAP 只承担写入和定期重新同步
+"""
+
+import hashlib
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from student_record import StudentRecord
+from student_paging import page_result
+
+# 建立索引需要的属性
+INDEX_ATTRIBUTES = list(StudentRecord.ATTRIBUTES)
+# 内容摘要按该模数累加各条目的哈希，与条目顺序和写入历史无关
+DIGEST_MODULUS = 1 << 128
+
+
+def record_digest(student):
+    """单个学生全部字段的哈希（整数）"""
+    text = '\0'.join(str(getattr(student, name)) for name in StudentRecord.__slots__)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest(), 'big')
+
+
+class StudentIndex:
+    """学生目录的内存索引，条目为 StudentRecord"""
+
+    def __init__(self):
+        self._by_uid = {}
+        self._by_class = {}
+        self._by_mail = {}
+        self._sorted_uids = []
+        self._lock = threading.RLock()
+        self._search_blob = None  # 子串搜索用的拼接文本，写操作后延迟重建
+        self._blob_offsets = None
+        self._blob_uids = None
+        self.loaded_at = None
+        self.version = 0
+        # 全部条目的内容摘要：目录内容相同的索引（不同进程、重建前后）摘要相同
+        self._digest = 0
+
+    # ---- 建立和更新 ----
+
+    def load(self, students):
+        """用一次全量扫描的结果重建索引"""
+        by_uid = {}
+        for student in students:
+            if student.uid:
+                by_uid[student.uid] = student
+        by_class = {}
+        by_mail = {}
+        digest = 0
+        for uid, student in by_uid.items():
+            by_class.setdefault(student.class_name, set()).add(uid)
+            if student.mail:
+                by_mail[student.mail.lower()] = uid
+            digest += record_digest(student)
+
+        with self._lock:
+            self._by_uid = by_uid
+            self._by_class = by_class
+            self._by_mail = by_mail
+            self._sorted_uids = sorted(by_uid)
+            self._digest = digest % DIGEST_MODULUS
+            self._search_blob = None
+            self.loaded_at = time.monotonic()
+            self.version += 1
+
+    def upsert(self, student):
+        """新增或更新单个学生"""
+        uid = student.uid
+        with self._lock:
+            old = self._by_uid.get(uid)
+            if old is not None:
+                self._unlink(old)
+                self._digest -= record_digest(old)
+            else:
+                self._sorted_uids.insert(bisect_left(self._sorted_uids, uid), uid)
+            self._by_uid[uid] = student
+            self._by_class.setdefault(student.class_name, set()).add(uid)
+            if student.mail:
+                self._by_mail[student.mail.lower()] = uid
+            self._digest = (self._digest + record_digest(student)) % DIGEST_MODULUS
+            self._search_blob = None
+            self.version += 1
+
+    def remove(self, uid):
+        """删除单个学生"""
+        with self._lock:
+            old = self._by_uid.pop(uid, None)
+            if old is None:
+                return False
+            self._unlink(old)
+            self._digest = (self._digest - record_digest(old)) % DIGEST_MODULUS
+            i = bisect_left(self._sorted_uids, uid)
+            if i < len(self._sorted_uids) and self._sorted_uids[i] == uid:
+                del self._sorted_uids[i]
+            self._search_blob = None
+            self.version += 1
+            return True
+
+    def _unlink(self, student):
+        members = self._by_class.get(student.class_name)
+        if members is not None:
+            members.discard(student.uid)
+            if not members:
+                del self._by_class[student.class_name]
+        if student.mail and self._by_mail.get(student.mail.lower()) == student.uid:
+            del self._by_mail[student.mail.lower()]
+
+    # ---- 查询 ----
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    @property
+    def etag(self):
+        """索引内容的验证器：由全部条目的内容摘要得出，内容变化时改变；
+        各进程的索引内容相同时验证器相同，条件请求可由任一工作进程回答 304
+        """
+        return f'{self._digest:032x}-{len(self._by_uid)}'
+
+    def __len__(self):
+        return len(self._by_uid)
+
+    def get(self, uid):
+        return self._by_uid.get(uid)
+
+    def uids(self):
+        """全部 uid 的快照，按 uid 排序"""
+        with self._lock:
+            return list(self._sorted_uids)
+
+    def get_by_mail(self, mail):
+        uid = self._by_mail.get(mail.lower())
+        return self._by_uid.get(uid) if uid else None
+
+    def in_class(self, class_name):
+        """班级成员，按 uid 排序"""
+        with self._lock:
+            uids = sorted(self._by_class.get(class_name, ()))
+            return [self._by_uid[uid] for uid in uids]
+
+    def class_counts(self):
+        with self._lock:
+            return {name: len(members) for name, members in self._by_class.items()}
+
+    def page(self, page=1, per_page=8, class_name=None, cursor=None):
+        """按 uid 排序分页，返回与 list_students 相同结构的结果
+
+        cursor 为上一页最后一个 uid（已解码）时从其后开始，页码由位置推算
+        """
+        with self._lock:
+            if class_name:
+                uids = sorted(self._by_class.get(class_name, ()))
+            else:
+                uids = self._sorted_uids
+            total = len(uids)
+            if cursor is not None:
+                start = bisect_right(uids, cursor)
+                page = start // per_page + 1
+            else:
+                start = (page - 1) * per_page
+            page_uids = uids[start:start + per_page]
+            students = [self._by_uid[uid] for uid in page_uids]
+
+        return page_result(students, page, per_page, total, start, page_uids[-1] if page_uids else None)
+
+    def _build_search_blob(self):
+        """把所有 uid/cn 拼成一段文本，子串搜索交给 str.find 在C层完成"""
+        parts = []
+        offsets = []
+        uids = []
+        position = 0
+        for uid in self._sorted_uids:
+            text = f"\n{uid}\t{self._by_uid[uid].cn}".lower()
+            parts.append(text)
+            offsets.append(position)
+            uids.append(uid)
+            position += len(text)
+        self._search_blob = ''.join(parts)
+        self._blob_offsets = offsets
+        self._blob_uids = uids
+
+    def search(self, query, limit=50, class_name=None):
+        """按 uid/cn 搜索：uid 前缀匹配优先，其次是 uid/cn 子串匹配"""
+        query = (query or '').strip().lower()
+        with self._lock:
+            if not query:
+                return self.page(1, limit, class_name)['students']
+
+            results = []
+            seen = set()
+            members = self._by_class.get(class_name, set()) if class_name else None
+
+            # uid 前缀：在排序列表上二分定位
+            start = bisect_left(self._sorted_uids, query)
+            end = bisect_right(self._sorted_uids, query + '￿')
+            for uid in self._sorted_uids[start:end]:
+                if members is None or uid in members:
+                    results.append(self._by_uid[uid])
+                    seen.add(uid)
+                    if len(results) >= limit:
+                        return results
+
+            # 子串
+            if self._search_blob is None:
+                self._build_search_blob()
+            blob = self._search_blob
+            position = blob.find(query)
+            while position != -1 and len(results) < limit:
+                i = bisect_right(self._blob_offsets, position) - 1
+                uid = self._blob_uids[i]
+                if uid not in seen and (members is None or uid in members):
+                    results.append(self._by_uid[uid])
+                    seen.add(uid)
+                next_start = self._blob_offsets[i + 1] if i + 1 < len(self._blob_offsets) else len(blob)
+                position = blob.find(query, next_start)
+            return results
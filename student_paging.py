@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学生列表分页
+使用 RFC 2696 分页控件（服务器支持时附带 RFC 2891 服务端排序）扫描学生键，
+缓存排序后的 uid 列表和总数，单页查询只读取当前页的条目
+"""
+
+import base64
+import threading
+import time
+from bisect import bisect_right
+from pyasn1.type import univ, namedtype, tag
+from pyasn1.codec.ber import encoder
+from ldap3 import SUBTREE
+from ldap3.utils.conv import escape_filter_chars
+
+SORT_CONTROL_OID = '1.2.840.113556.1.4.473'  # 服务端排序 [RFC 2891]
+
+
+class SortKey(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('attributeType', univ.OctetString()),
+        namedtype.OptionalNamedType('orderingRule', univ.OctetString().subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+        namedtype.DefaultedNamedType('reverseOrder', univ.Boolean(False).subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1)))
+    )
+
+
+class SortKeyList(univ.SequenceOf):
+    componentType = SortKey()
+
+
+def build_sort_control(attributes, criticality=False):
+    """构造服务端排序控件，attributes 为排序属性列表，以 '-' 开头表示倒序"""
+    keys = SortKeyList()
+    for i, attribute in enumerate(attributes):
+        key = SortKey()
+        key['attributeType'] = attribute.lstrip('-')
+        if attribute.startswith('-'):
+            key['reverseOrder'] = True
+        keys.setComponentByPosition(i, key)
+    return SORT_CONTROL_OID, criticality, encoder.encode(keys)
+
+
+def supports_sort(conn):
+    """服务器是否声明支持服务端排序"""
+    info = conn.server.info
+    if not info or not info.supported_controls:
+        return False
+    return any(control[0] == SORT_CONTROL_OID for control in info.supported_controls)
+
+
+def paged_search(conn, search_base, search_filter, attributes, page_size=500, sort_by=None):
+    """在同一个连接上按 RFC 2696 分页检索，每次产出一页原始响应条目"""
+    controls = None
+    if sort_by and supports_sort(conn):
+        controls = [build_sort_control(sort_by)]
+
+    cookie = None
+    while True:
+        conn.search(search_base, search_filter, search_scope=SUBTREE,
+                    attributes=attributes, paged_size=page_size,
+                    paged_cookie=cookie, controls=controls)
+        yield [item for item in conn.response if item.get('type') == 'searchResEntry']
+
+        cookie = (conn.result.get('controls') or {}).get(
+            '1.2.840.113556.1.4.319', {}).get('value', {}).get('cookie')
+        if not cookie:
+            break
+
+
+def encode_cursor(uid):
+    """将最后一条记录的 uid 编码为不透明游标"""
+    return base64.urlsafe_b64encode(uid.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，非法游标返回 None"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    except Exception:
+        return None
+
+
+def page_result(students, page, per_page, total, start, last_uid=None):
+    """列表接口的返回结构：当前页的学生和分页信息
+
+    start 为本页第一条在全部记录中的位置，last_uid 为本页最后一个 uid（有下一页时编码为 next_cursor）
+    """
+    total_pages = (total + per_page - 1) // per_page
+    has_prev = page > 1
+    has_next = start + per_page < total
+    return {
+        'students': students,
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_pages': total_pages,
+            'has_prev': has_prev,
+            'has_next': has_next,
+            'prev_page': page - 1 if has_prev else None,
+            'next_page': page + 1 if has_next else None,
+            'next_cursor': encode_cursor(last_uid) if has_next and last_uid else None
+        }
+    }
+
+
+def empty_page(per_page):
+    """查询失败时返回的空列表"""
+    return page_result([], 1, per_page, 0, 0)
+
+
+def uid_filter(uids, object_class='inetOrgPerson'):
+    """构造按 uid 精确匹配一组条目的过滤器"""
+    terms = ''.join(f'(uid={escape_filter_chars(uid)})' for uid in uids)
+    return f'(&(objectClass={object_class})(|{terms}))'
+
+
+class StudentPager:
+    """缓存学生 uid 键列表（按 uid 排序）和总数，供分页和游标导航使用"""
+
+    def __init__(self, ttl=60, scan_page_size=1000):
+        self.ttl = ttl
+        self.scan_page_size = scan_page_size
+        self._keys = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """学生增删后使键缓存失效"""
+        with self._lock:
+            self._keys = None
+
+    def keys(self, conn, search_base, search_filter='(objectClass=inetOrgPerson)'):
+        """返回排序后的 uid 列表，过期时重新扫描"""
+        with self._lock:
+            if self._keys is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._keys
+
+        keys = []
+        for page in paged_search(conn, search_base, search_filter, ['uid'],
+                                 page_size=self.scan_page_size, sort_by=['uid']):
+            for item in page:
+                uid = item['attributes'].get('uid')
+                if uid:
+                    keys.append(uid[0] if isinstance(uid, list) else uid)
+        # 服务端排序不可用时在本地排序；已排序的列表上 sort 几乎没有开销
+        keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+        return keys
+
+    @staticmethod
+    def slice_page(keys, page, per_page):
+        """按页码切片"""
+        start = (page - 1) * per_page
+        return keys[start:start + per_page]
+
+    @staticmethod
+    def slice_after(keys, cursor_uid, per_page):
+        """返回游标之后的一页 uid 及其在列表中的起始位置"""
+        start = bisect_right(keys, cursor_uid)
+        return keys[start:start + per_page], start
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+名册对账同步
+把教务处下发的完整名册与目录比较：按uid做集合差得到新增和删除，对两边都有的学生
+比较 (cn, sn, mail, 班级) 元组得到属性级修改，只把这份最小变更集写入目录
+"""
+
+import threading
+import time
+from ldap3 import MODIFY_REPLACE
+from student_paging import paged_search
+from student_record import StudentRecord, CLASS_PREFIX, UNASSIGNED_CLASS
+from student_bulk import run_in_batches
+from student_import import BulkImporter, ImportReport, STATUS_ADDED, prepare_students
+
+# 参与比较的字段，class_name 只在名册带有该列时比较
+COMPARED_FIELDS = ('cn', 'sn', 'mail', 'class_name')
+
+ACTION_ADD = 'add'
+ACTION_MODIFY = 'modify'
+ACTION_DELETE = 'delete'
+
+
+def directory_snapshot(manager, page_size=1000):
+    """一次分页扫描取回目录中所有学生的比较字段，返回 {uid: StudentRecord}"""
+    search_base = f'ou=students,{manager.LDAP_BASE_DN}'
+    snapshot = {}
+    with manager.pool.connection() as conn:
+        for page in paged_search(conn, search_base, '(objectClass=inetOrgPerson)',
+                                 StudentRecord.ATTRIBUTES, page_size):
+            for item in page:
+                record = StudentRecord.from_raw(item['raw_attributes'])
+                if record.uid:
+                    snapshot[record.uid] = record
+    return snapshot
+
+
+def _roster_class(record):
+    return record['class_name'] or UNASSIGNED_CLASS
+
+
+class ReconcilePlan:
+    """名册与目录的差异
+
+    - adds: 需要新增的名册记录
+    - modifies: {uid: {字段: (目录中的值, 名册中的值)}}
+    - deletes: 目录中有、名册中没有的uid（仅在 delete=True 时填充）
+    - protected: 带角色（如管理员）的账号，不参与修改和删除
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.adds = []
+        self.modifies = {}
+        self.deletes = []
+        self.invalid = []
+        self.protected = []
+        self.unchanged = 0
+        self.roster_total = 0
+        self.directory_total = 0
+        self.compare_classes = True
+        self.elapsed = 0.0
+
+    @property
+    def change_count(self):
+        return len(self.adds) + len(self.modifies) + len(self.deletes)
+
+    def to_dict(self, max_items=50):
+        """对账报告，max_items 限制每类变更列出的明细条数（None 表示全部）"""
+        def head(items):
+            return items if max_items is None else items[:max_items]
+
+        modifies = [{'uid': uid, 'changes': {name: {'from': old, 'to': new} for name, (old, new) in changes.items()}}
+                    for uid, changes in sorted(self.modifies.items())]
+        return {
+            'source': self.source,
+            'roster_total': self.roster_total,
+            'directory_total': self.directory_total,
+            'adds': len(self.adds),
+            'modifies': len(self.modifies),
+            'deletes': len(self.deletes),
+            'unchanged': self.unchanged,
+            'invalid': len(self.invalid),
+            'protected': len(self.protected),
+            'compare_classes': self.compare_classes,
+            'elapsed': round(self.elapsed, 3),
+            'add_rows': head([{'row': record['row'], 'uid': record['uid']} for record in self.adds]),
+            'modify_rows': head(modifies),
+            'delete_rows': head(sorted(self.deletes)),
+            'invalid_rows': head([{'row': row, 'uid': uid, 'message': reason} for row, uid, reason in self.invalid])
+        }
+
+
+def plan_reconcile(frame, snapshot, source, delete=False):
+    """比较名册（DataFrame）和目录快照，返回 ReconcilePlan"""
+    started = time.perf_counter()
+    plan = ReconcilePlan(source)
+    plan.compare_classes = 'class_name' in frame.columns
+    records, plan.invalid = prepare_students(frame)
+    plan.roster_total = len(frame)
+    plan.directory_total = len(snapshot)
+
+    roster = {record['uid']: record for record in records}
+    roster_uids = roster.keys()
+    directory_uids = snapshot.keys()
+
+    plan.adds = [roster[uid] for uid in roster_uids - directory_uids]
+    plan.adds.sort(key=lambda record: record['row'])
+
+    fields = COMPARED_FIELDS if plan.compare_classes else COMPARED_FIELDS[:-1]
+    for uid in roster_uids & directory_uids:
+        current = snapshot[uid]
+        if current.role:
+            plan.protected.append(uid)
+            continue
+        record = roster[uid]
+        wanted = (record['cn'], record['sn'], record['mail'], _roster_class(record))[:len(fields)]
+        existing = tuple(getattr(current, name) for name in fields)
+        if wanted == existing:
+            plan.unchanged += 1
+            continue
+        plan.modifies[uid] = {name: (old, new) for name, old, new in zip(fields, existing, wanted) if old != new}
+
+    if delete:
+        for uid in directory_uids - roster_uids:
+            if snapshot[uid].role:
+                plan.protected.append(uid)
+            else:
+                plan.deletes.append(uid)
+    plan.protected.sort()
+    plan.elapsed = time.perf_counter() - started
+    return plan
+
+
+class ReconcileReport:
+    """对账结果，dry_run 时只有差异没有写入"""
+
+    def __init__(self, plan, dry_run=True):
+        self.plan = plan
+        self.dry_run = dry_run
+        self.applied = {ACTION_ADD: 0, ACTION_MODIFY: 0, ACTION_DELETE: 0}
+        self.failed = []  # (动作, uid, 原因)
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, action, uid, error=None):
+        with self._lock:
+            if error is None:
+                self.applied[action] += 1
+            else:
+                self.failed.append((action, uid, error))
+
+    def to_dict(self, max_items=50):
+        result = self.plan.to_dict(max_items)
+        result['dry_run'] = self.dry_run
+        result['applied'] = dict(self.applied)
+        result['failed'] = len(self.failed)
+        result['failed_rows'] = [{'action': action, 'uid': uid, 'message': message}
+                                 for action, uid, message in self.failed[:max_items]]
+        result['apply_elapsed'] = round(self.elapsed, 3)
+        return result
+
+
+def _modify_changes(changes):
+    """把字段差异转换为 LDAP 修改请求，以及更新索引用的新值"""
+    request = {}
+    values = {}
+    for name, (_, new) in changes.items():
+        if name == 'class_name':
+            description = f'{CLASS_PREFIX}{new}' if new != UNASSIGNED_CLASS else ''
+            request['description'] = [(MODIFY_REPLACE, [description] if description else [])]
+            values['description'] = description
+        else:
+            request[name] = [(MODIFY_REPLACE, [new])]
+            values[name] = new
+    return request, values
+
+
+class Reconciler:
+    """执行对账变更集：新增复用批量导入流水线，修改和删除按批在多个连接上并行"""
+
+    def __init__(self, manager, workers=4, batch_size=200):
+        self.manager = manager
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+    def _modify_batch(self, batch, report):
+        manager = self.manager
+        with manager.pool.connection() as conn:
+            for uid, changes in batch:
+                try:
+                    request, values = _modify_changes(changes)
+                    if conn.modify(manager.student_dn(uid), request):
+                        manager.identity_cache.invalidate(uid)
+                        manager.update_index(uid, values)
+                        if 'class_name' in changes:
+                            previous, class_name = changes['class_name']
+                            manager.update_class_roster(conn, uid, class_name, previous=previous)
+                        report.record(ACTION_MODIFY, uid)
+                    else:
+                        report.record(ACTION_MODIFY, uid, str(conn.last_error))
+                except Exception as e:
+                    report.record(ACTION_MODIFY, uid, str(e))
+
+    def _delete_batch(self, batch, report, snapshot):
+        manager = self.manager
+        with manager.pool.connection() as conn:
+            for uid in batch:
+                try:
+                    if conn.delete(manager.student_dn(uid)):
+                        manager.identity_cache.invalidate(uid)
+                        manager.student_index.remove(uid)
+                        manager.update_class_roster(conn, uid, None, previous=snapshot[uid].class_name)
+                        report.record(ACTION_DELETE, uid)
+                    else:
+                        report.record(ACTION_DELETE, uid, str(conn.last_error))
+                except Exception as e:
+                    report.record(ACTION_DELETE, uid, str(e))
+
+    def apply(self, plan, snapshot):
+        """写入变更集，返回 ReconcileReport"""
+        started = time.perf_counter()
+        report = ReconcileReport(plan, dry_run=False)
+
+        if plan.adds:
+            importer = BulkImporter(self.manager, self.workers, self.batch_size)
+            added = importer.import_records(list(plan.adds), ImportReport(plan.source), set(snapshot))
+            report.applied[ACTION_ADD] = added.success_count
+            for row in added.rows:
+                if row['status'] != STATUS_ADDED:
+                    report.record(ACTION_ADD, row['uid'], row['message'])
+
+        run_in_batches(sorted(plan.modifies.items()), lambda batch: self._modify_batch(batch, report),
+                       self.workers, self.batch_size)
+        run_in_batches(plan.deletes, lambda batch: self._delete_batch(batch, report, snapshot),
+                       self.workers, self.batch_size)
+
+        if plan.deletes:
+            self.manager.invalidate_listing()
+        report.elapsed = time.perf_counter() - started
+        return report
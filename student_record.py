@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学生记录
+用 __slots__ 保存学生的常用字段，description 中的班级和角色只在这里解析一次；
+可直接由搜索响应的 raw_attributes 构造，不经过 ldap3 的 Entry 对象
+"""
+
+import re
+import sys
+
+CLASS_PREFIX = '班级: '
+ROLE_PREFIX = 'role:'
+UNASSIGNED_CLASS = '未分配'
+# role: 之后的角色以逗号、分号或空白结束，如 'role:admin,teacher' 的角色为 admin
+ROLE_SEPARATORS = re.compile(r'[,;\s]+')
+ADMIN_CLASS = '管理员'
+# 对外提供的字段（列表接口的 fields= 和导出的列），按该顺序输出
+RECORD_COLUMNS = ('uid', 'cn', 'sn', 'mail', 'class_name')
+
+
+def resolve_columns(columns):
+    """校验并返回要输出的字段，为空表示全部字段；有不支持的字段时抛出 ValueError"""
+    if not columns:
+        return list(RECORD_COLUMNS)
+    unknown = [name for name in columns if name not in RECORD_COLUMNS]
+    if unknown:
+        raise ValueError(f"不支持的字段: {', '.join(unknown)}")
+    return list(columns)
+
+
+def parse_description(description):
+    """解析 description，返回 (班级名称, 角色)
+
+    '班级: 计算机2021-1班' -> ('计算机2021-1班', None)
+    'role:admin'          -> ('管理员', 'admin')
+    'role:admin;x'        -> ('管理员', 'admin')
+    """
+    if not description:
+        return UNASSIGNED_CLASS, None
+    if description.startswith(CLASS_PREFIX):
+        return description[len(CLASS_PREFIX):].strip() or UNASSIGNED_CLASS, None
+
+    lowered = description.lower()
+    position = lowered.find(ROLE_PREFIX)
+    role = None
+    if position != -1:
+        role = ROLE_SEPARATORS.split(lowered[position + len(ROLE_PREFIX):].lstrip(), 1)[0] or None
+    if description.startswith(ROLE_PREFIX):
+        return ADMIN_CLASS, role
+    return UNASSIGNED_CLASS, role
+
+
+def parse_class_name(description):
+    """从 description 解析班级名称"""
+    return parse_description(description)[0]
+
+
+def parse_role(description):
+    """从 description 解析角色（如 admin），没有角色时返回 None"""
+    return parse_description(description)[1]
+
+
+def _decode(values):
+    """raw_attributes 中的第一个值解码为字符串"""
+    if not values:
+        return ''
+    value = values[0]
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return str(value[0]) if value else ''
+    return '' if value is None else str(value)
+
+
+class StudentRecord:
+    """一个学生的列表字段"""
+
+    # 构造记录需要的全部属性，搜索时只请求这些
+    ATTRIBUTES = ('uid', 'cn', 'sn', 'mail', 'description')
+
+    __slots__ = ('uid', 'cn', 'sn', 'mail', 'class_name', 'role')
+
+    def __init__(self, uid, cn='', sn='', mail='', class_name=UNASSIGNED_CLASS, role=None):
+        self.uid = uid
+        self.cn = cn
+        self.sn = sn
+        self.mail = mail
+        # 班级名称在大量记录间重复，驻留后只保存一份
+        self.class_name = sys.intern(class_name)
+        self.role = role
+
+    @classmethod
+    def from_description(cls, uid, cn, sn, mail, description):
+        class_name, role = parse_description(description)
+        return cls(uid, cn, sn, mail, class_name, role)
+
+    @classmethod
+    def from_raw(cls, raw_attributes):
+        """由搜索响应的 raw_attributes（属性名 -> 字节串列表）构造"""
+        get = raw_attributes.get
+        return cls.from_description(_decode(get('uid')), _decode(get('cn')), _decode(get('sn')),
+                                    _decode(get('mail')), _decode(get('description')))
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        """由已解码的属性字典构造（如 student_attributes() 的返回值）"""
+        get = attributes.get
+        return cls.from_description(_first(get('uid')), _first(get('cn')), _first(get('sn')),
+                                    _first(get('mail')), _first(get('description')))
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def replace(self, **changes):
+        """返回修改了部分字段的新记录，changes 中的 description 会重新解析班级和角色"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        if 'description' in changes:
+            values['class_name'], values['role'] = parse_description(changes.pop('description'))
+        values.update(changes)
+        return StudentRecord(**values)
+
+    def to_dict(self):
+        """与 list_students 返回格式一致的字典"""
+        return {
+            'uid': self.uid,
+            'cn': self.cn,
+            'sn': self.sn,
+            'mail': self.mail,
+            'class_name': self.class_name
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, StudentRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'StudentRecord(uid={self.uid!r}, cn={self.cn!r}, class_name={self.class_name!r})'
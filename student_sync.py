@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录增量同步
+后台线程轮询服务器的 contextCSN，只有目录发生变化时才按 modifyTimestamp 取回变更条目，
+并用一次只取DN的扫描发现删除，把变化应用到学生索引和身份缓存
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from ldap3 import BASE, NO_ATTRIBUTES
+from ldap3.core.exceptions import LDAPAttributeError
+from student_paging import paged_search
+from student_index import INDEX_ATTRIBUTES
+from student_record import StudentRecord
+from log_utils import get_logger, fields
+
+logger = get_logger('sync')
+
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%SZ'
+
+
+def _timestamp_from_csn(csn):
+    """contextCSN 形如 20261016120000.123456Z#000000#000#000000，取出秒级时间戳"""
+    return csn[:14] + 'Z'
+
+
+def _uid_from_dn(dn):
+    rdn = dn.split(',', 1)[0]
+    return rdn.split('=', 1)[1] if '=' in rdn else None
+
+
+class DirectorySync:
+    """学生目录的增量同步器
+
+    - interval: 轮询间隔，秒
+    - deletion_scan_interval: 两次删除检测扫描之间至少间隔的秒数（与 contextCSN 是否变化无关，
+      本应用自己的写操作也会改变 contextCSN）
+    - overlap: 首次启动且没有 contextCSN 时，从当前时间往前回看的秒数（吸收时钟偏差）
+    """
+
+    def __init__(self, manager, interval=5, deletion_scan_interval=60, overlap=60):
+        self.manager = manager
+        self.interval = interval
+        self.deletion_scan_interval = deletion_scan_interval
+        self.overlap = overlap
+        self.watermark = None  # 已同步到的最大 modifyTimestamp
+        # 上次查询取回的条目 {uid: modifyTimestamp}：水位线按等号比较，同一秒的条目会被重复取回
+        self._seen = {}
+        self._last_deletion_scan = None
+        self._deletions_pending = False
+        self.csn = None
+        self.polls = 0
+        self.changed = 0
+        self.deleted = 0
+        self.errors = 0
+        self.last_sync = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+
+    def start(self):
+        """启动后台同步线程（重复调用无副作用）"""
+        if self._thread is None and self.interval > 0:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name='ldap-sync', daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = self.poll()
+                if result['changed'] or result['deleted']:
+                    logger.info('🔄 目录增量同步', extra=fields(**result))
+            except Exception:
+                self.errors += 1
+                logger.exception('❌ 目录增量同步失败')
+
+    def _read_csn(self, conn):
+        """读取数据库后缀条目上的 contextCSN，服务器未启用 syncprov 时返回 None"""
+        try:
+            conn.search(self.manager.LDAP_BASE_DN, '(objectClass=*)', search_scope=BASE, attributes=['contextCSN'])
+        except LDAPAttributeError:
+            # 客户端加载的schema中没有该属性
+            return None
+        if not conn.response:
+            return None
+        values = conn.response[0].get('attributes', {}).get('contextCSN')
+        if not values:
+            return None
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        # 多主复制时每个服务器各有一个值
+        return tuple(sorted(str(value) for value in values))
+
+    def poll(self):
+        """执行一次同步，返回本次应用的变更数 {'changed': n, 'deleted': m}"""
+        with self._poll_lock:
+            self.polls += 1
+            with self.manager.connection() as conn:
+                csn = self._read_csn(conn)
+
+                if self.watermark is None:
+                    # 首次轮询只建立基线：之后的变化才需要同步
+                    if csn:
+                        self.watermark = max(_timestamp_from_csn(value) for value in csn)
+                    else:
+                        start = datetime.now(timezone.utc) - timedelta(seconds=self.overlap)
+                        self.watermark = start.strftime(TIMESTAMP_FORMAT)
+                    self.csn = csn
+                    self._last_deletion_scan = time.monotonic()
+                    self.last_sync = time.time()
+                    return {'changed': 0, 'deleted': 0}
+
+                changed = 0
+                if csn is None or csn != self.csn:
+                    changed = self._apply_changes(conn)
+                    # 目录有变化（或无法判断）时才可能有删除，扫描按间隔限流，推迟的扫描在之后的轮询中补做
+                    self._deletions_pending = True
+                deleted = 0
+                if (self._deletions_pending and
+                        time.monotonic() - self._last_deletion_scan >= self.deletion_scan_interval):
+                    deleted = self._apply_deletions(conn)
+                    self._last_deletion_scan = time.monotonic()
+                    self._deletions_pending = False
+                self.csn = csn
+
+            if changed or deleted:
+                self.manager.invalidate_listing()
+            self.changed += changed
+            self.deleted += deleted
+            self.last_sync = time.time()
+            return {'changed': changed, 'deleted': deleted}
+
+    def _apply_changes(self, conn):
+        """取回 modifyTimestamp 不早于水位线的条目，只把时间戳变化了的条目更新到索引"""
+        manager = self.manager
+        index = manager.student_index
+        search_base = f'ou=students,{manager.LDAP_BASE_DN}'
+        search_filter = f'(&(objectClass=inetOrgPerson)(modifyTimestamp>={self.watermark}))'
+        watermark = self.watermark
+        seen = {}
+        count = 0
+        for page in paged_search(conn, search_base, search_filter, INDEX_ATTRIBUTES + ['modifyTimestamp']):
+            for item in page:
+                attributes = item['raw_attributes']
+                timestamp = attributes.get('modifyTimestamp')
+                timestamp = timestamp[0].decode() if timestamp else None
+                student = StudentRecord.from_raw(attributes)
+                if not student.uid:
+                    continue
+                seen[student.uid] = timestamp
+                if timestamp is not None and self._seen.get(student.uid) == timestamp:
+                    # 上次已经应用过的同一版本，不再更新索引（避免无谓地增加索引版本）
+                    continue
+                manager.identity_cache.invalidate(student.uid)
+                if index.loaded:
+                    index.upsert(student)
+                if timestamp and timestamp > watermark:
+                    watermark = timestamp
+                count += 1
+        # 水位线取等号比较，同一秒内的后续修改不会漏掉；重复取回的同一版本按 _seen 跳过
+        self.watermark = watermark
+        self._seen = seen
+        return count
+
+    def _apply_deletions(self, conn):
+        """只取DN扫描一遍目录，把索引中已不存在的学生删除"""
+        manager = self.manager
+        index = manager.student_index
+        if not index.loaded:
+            return 0
+        search_base = f'ou=students,{manager.LDAP_BASE_DN}'
+        # 只比较扫描开始前已在索引中的学生，扫描期间由本应用新增的学生不会被误删
+        known = index.uids()
+        present = set()
+        for page in paged_search(conn, search_base, '(objectClass=inetOrgPerson)', NO_ATTRIBUTES, page_size=1000):
+            for item in page:
+                uid = _uid_from_dn(item['dn'])
+                if uid:
+                    present.add(uid)
+        count = 0
+        for uid in known:
+            if uid not in present:
+                index.remove(uid)
+                manager.identity_cache.invalidate(uid)
+                count += 1
+        return count
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'watermark': self.watermark,
+            'context_csn': list(self.csn) if self.csn else None,
+            'polls': self.polls,
+            'changed': self.changed,
+            'deleted': self.deleted,
+            'errors': self.errors,
+            'last_sync': self.last_sync
+        }
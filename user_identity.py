@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求级用户身份
+一次LDAP查询取回角色、姓名和个人信息，供同一请求内的所有辅助函数和装饰器使用
+"""
+
+from ldap3 import BASE
+from student_record import StudentRecord, parse_role
+
+
+class UserIdentity:
+    """登录用户的身份信息"""
+
+    # 身份查询需要的全部属性，一次取回
+    ATTRIBUTES = list(StudentRecord.ATTRIBUTES)
+
+    __slots__ = ('uid', 'cn', 'sn', 'mail', 'description')
+
+    def __init__(self, uid, cn='', sn='', mail='', description=None):
+        self.uid = uid
+        self.cn = cn
+        self.sn = sn
+        self.mail = mail
+        self.description = description
+
+    @classmethod
+    def from_entry(cls, entry):
+        """由 ldap3 Entry 构造"""
+        return cls(
+            uid=str(entry.uid),
+            cn=str(entry.cn),
+            sn=str(entry.sn),
+            mail=str(entry.mail),
+            description=str(entry.description) if hasattr(entry, 'description') else None
+        )
+
+    @classmethod
+    def from_raw(cls, raw_attributes):
+        """由搜索响应的 raw_attributes 构造，不经过 Entry 对象"""
+        def first(name):
+            values = raw_attributes.get(name)
+            return values[0].decode('utf-8', 'replace') if values else None
+        return cls(
+            uid=first('uid') or '',
+            cn=first('cn') or '',
+            sn=first('sn') or '',
+            mail=first('mail') or '',
+            description=first('description')
+        )
+
+    @property
+    def is_admin(self):
+        """description 中包含 role:admin 即为管理员"""
+        return parse_role(self.description) == 'admin'
+
+    @property
+    def display_name(self):
+        return self.cn or '未知用户'
+
+    def to_user_info(self):
+        """与 get_user_info() 返回格式一致的字典"""
+        return {
+            'uid': self.uid,
+            'cn': self.cn,
+            'sn': self.sn,
+            'mail': self.mail,
+            'description': self.description if self.description is not None else '未设置'
+        }
+
+
+def load_identity(manager, username, use_cache=True):
+    """加载用户身份：先查进程缓存，未命中时用一次查询取回，用户不存在时返回 None"""
+    cache = manager.identity_cache if use_cache else None
+    if cache is not None:
+        identity = cache.get(username)
+        if identity is not None:
+            return identity
+
+    dn = manager.student_dn(username)
+    with manager.connection() as conn:
+        conn.search(dn, '(objectClass=inetOrgPerson)', search_scope=BASE, attributes=UserIdentity.ATTRIBUTES)
+        if not conn.response:
+            return None
+        identity = UserIdentity.from_raw(conn.response[0]['raw_attributes'])
+
+    if cache is not None:
+        cache.set(username, identity)
+    return identity